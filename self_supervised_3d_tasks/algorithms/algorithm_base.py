@@ -31,13 +31,40 @@ class AlgorithmBuilderBase:
     def get_training_preprocessing(self):
         pass
 
+    def get_samples_per_input(self):
+        """
+        Number of samples the training preprocessing produces from one input file.
+        Generators read it from the preprocessing functions instead of preprocessing a probe file.
+        """
+        return 1
+
+    def is_preprocessing_layout_only(self):
+        """
+        True if the training preprocessing only moves values around (crops, patches, permutations, flips, zero padding).
+        Generators can then keep compact stored data in its storage dtype until the batch is finished.
+        """
+        return True
+
+    def describe_preprocessing(self, *pre_proc_funcs):
+        for f in pre_proc_funcs:
+            f.samples_per_input = self.get_samples_per_input()
+            f.layout_only = self.is_preprocessing_layout_only()
+            f.takes_rngs = True  # accepts one random generator per input file as keyword rngs
+
+        return pre_proc_funcs
+
     def get_finetuning_preprocessing(self):
         def f_identity(x, y):
             return x, y
 
+        f_identity.samples_per_input = 1
+        f_identity.layout_only = True
         return f_identity, f_identity
 
-    def get_finetuning_model(self, model_checkpoint=None):
+    def get_finetuning_model(self, model_checkpoint=None, variable_shape=False):
+        if variable_shape:
+            return self.get_finetuning_model_patches(model_checkpoint, variable_shape)
+
         model = self.apply_model()
         assert self.enc_model is not None, "no encoder model"
 
@@ -62,7 +89,11 @@ class AlgorithmBuilderBase:
 
         return self.enc_model
 
-    def get_finetuning_model_patches(self, model_checkpoint):
+    def get_finetuning_model_patches(self, model_checkpoint, variable_shape=False):
+        """
+        Copy the weights of the encoder into an encoder of the full input size. With variable_shape its spatial
+        axes are None, so it accepts batches of different shape buckets.
+        """
         model = self.apply_model()
         assert self.enc_model is not None, "no encoder model"
 
@@ -72,9 +103,10 @@ class AlgorithmBuilderBase:
         self.cleanup_models.append(model)
         self.cleanup_models.append(self.enc_model)
 
+        dim = None if variable_shape else self.data_dim
         if self.data_is_3D:
             new_enc, self.layer_data = make_finetuning_encoder_3d(
-                (self.data_dim, self.data_dim, self.data_dim, self.number_channels,),
+                (dim, dim, dim, self.number_channels,),
                 self.enc_model,
                 **self.kwargs
             )
@@ -82,7 +114,7 @@ class AlgorithmBuilderBase:
             return new_enc
         else:
             new_enc, self.layer_data = make_finetuning_encoder_2d(
-                (self.data_dim, self.data_dim, self.number_channels,),
+                (dim, dim, self.number_channels,),
                 self.enc_model,
                 **self.kwargs
             )
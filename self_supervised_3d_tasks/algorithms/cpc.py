@@ -117,19 +117,26 @@ class CPCBuilder(AlgorithmBuilderBase):
         return model
 
     def get_training_preprocessing(self):
-        def f(x, y):  # not using y here, as it gets generated
-            return preprocess_grid_2d(preprocess_2d(x, self.crop_size, self.patches_per_side))
+        def f(x, y, rngs=None):  # not using y here, as it gets generated
+            return preprocess_grid_2d(preprocess_2d(x, self.crop_size, self.patches_per_side, rngs=rngs), rngs=rngs)
 
-        def f_3d(x, y):  # not using y here, as it gets generated
-            return preprocess_grid_3d(preprocess_3d(x, self.crop_size, self.patches_per_side))
+        def f_3d(x, y, rngs=None):  # not using y here, as it gets generated
+            return preprocess_grid_3d(preprocess_3d(x, self.crop_size, self.patches_per_side, rngs=rngs), rngs=rngs)
 
         if self.data_is_3D:
-            return f_3d, f_3d
+            return self.describe_preprocessing(f_3d, f_3d)
         else:
-            return f, f
+            return self.describe_preprocessing(f, f)
 
-    def get_finetuning_model(self, model_checkpoint=None):
-        return super(CPCBuilder, self).get_finetuning_model_patches(model_checkpoint)
+    def get_samples_per_input(self):
+        # one positive and one negative example for every column of the patch grid (and every depth in 3D)
+        if self.data_is_3D:
+            return 2 * self.patches_per_side ** 2
+        else:
+            return 2 * self.patches_per_side
+
+    def get_finetuning_model(self, model_checkpoint=None, variable_shape=False):
+        return super(CPCBuilder, self).get_finetuning_model_patches(model_checkpoint, variable_shape)
 
 
 def create_instance(*params, **kwargs):
@@ -22,11 +22,13 @@ class ExemplarBuilder(AlgorithmBuilderBase):
             code_size=1024,
             lr=1e-4,
             sample_neg_examples_from="batch",
+            negative_pool_size=0,
             **kwargs
     ):
         super(ExemplarBuilder, self).__init__(data_dim, number_channels, lr, data_is_3D, **kwargs)
 
         self.sample_neg_examples_from = sample_neg_examples_from
+        self.negative_pool_size = negative_pool_size
         self.dim = (
             (data_dim, data_dim, data_dim) if self.data_is_3D else (data_dim, data_dim)
         )
@@ -69,8 +71,12 @@ class ExemplarBuilder(AlgorithmBuilderBase):
         return model
 
     def get_training_preprocessing(self):
-        f = get_exemplar_training_preprocessing(self.data_is_3D, self.sample_neg_examples_from)
-        return f, f
+        f = get_exemplar_training_preprocessing(self.data_is_3D, self.sample_neg_examples_from,
+                                               self.negative_pool_size)
+        return self.describe_preprocessing(f, f)
+
+    def is_preprocessing_layout_only(self):
+        return False  # the augmentations distort the intensities
 
 def create_instance(*params, **kwargs):
     return ExemplarBuilder(*params, **kwargs)
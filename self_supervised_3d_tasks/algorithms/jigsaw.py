@@ -94,7 +94,7 @@ class JigsawBuilder(AlgorithmBuilderBase):
         else:
             perms, _ = load_permutations()
 
-        def f_train(x, y):  # not using y here, as it gets generated
+        def f_train(x, y, rngs=None):  # not using y here, as it gets generated
             x, y = preprocess(
                 x,
                 self.patches_per_side,
@@ -102,10 +102,11 @@ class JigsawBuilder(AlgorithmBuilderBase):
                 perms,
                 is_training=True,
                 mode3d=self.data_is_3D,
+                rngs=rngs,
             )
             return x, y
 
-        def f_val(x, y):
+        def f_val(x, y, rngs=None):
             x, y = preprocess(
                 x,
                 self.patches_per_side,
@@ -113,13 +114,14 @@ class JigsawBuilder(AlgorithmBuilderBase):
                 perms,
                 is_training=False,
                 mode3d=self.data_is_3D,
+                rngs=rngs,
             )
             return x, y
 
-        return f_train, f_val
+        return self.describe_preprocessing(f_train, f_val)
 
-    def get_finetuning_model(self, model_checkpoint=None):
-        return super(JigsawBuilder, self).get_finetuning_model_patches(model_checkpoint)
+    def get_finetuning_model(self, model_checkpoint=None, variable_shape=False):
+        return super(JigsawBuilder, self).get_finetuning_model_patches(model_checkpoint, variable_shape)
 
     def purge(self):
         for i in reversed(range(len(self.cleanup_models))):
@@ -76,19 +76,19 @@ class RelativePatchLocationBuilder(AlgorithmBuilderBase):
         return model
 
     def get_training_preprocessing(self):
-        def f(x, y):  # not using y here, as it gets generated
-            return preprocess_batch(x, self.patches_per_side, self.patch_jitter)
+        def f(x, y, rngs=None):  # not using y here, as it gets generated
+            return preprocess_batch(x, self.patches_per_side, self.patch_jitter, rngs=rngs)
 
-        def f_3d(x, y):
-            return preprocess_batch_3d(x, self.patches_per_side, self.patch_jitter)
+        def f_3d(x, y, rngs=None):
+            return preprocess_batch_3d(x, self.patches_per_side, self.patch_jitter, rngs=rngs)
 
         if self.data_is_3D:
-            return f_3d, f_3d
+            return self.describe_preprocessing(f_3d, f_3d)
         else:
-            return f, f
+            return self.describe_preprocessing(f, f)
 
-    def get_finetuning_model(self, model_checkpoint=None):
-        return super(RelativePatchLocationBuilder, self).get_finetuning_model_patches(model_checkpoint)
+    def get_finetuning_model(self, model_checkpoint=None, variable_shape=False):
+        return super(RelativePatchLocationBuilder, self).get_finetuning_model_patches(model_checkpoint, variable_shape)
 
 
 def create_instance(*params, **kwargs):
@@ -64,16 +64,16 @@ class RotationBuilder(AlgorithmBuilderBase):
         return model
 
     def get_training_preprocessing(self):
-        def f(x, y):  # not using y here, as it gets generated
-            return rotate_batch(x, y)
+        def f(x, y, rngs=None):  # not using y here, as it gets generated
+            return rotate_batch(x, y, rngs)
 
-        def f_3d(x, y):
-            return rotate_batch_3d(x, y)
+        def f_3d(x, y, rngs=None):
+            return rotate_batch_3d(x, y, rngs)
 
         if self.data_is_3D:
-            return f_3d, f_3d
+            return self.describe_preprocessing(f_3d, f_3d)
         else:
-            return f, f
+            return self.describe_preprocessing(f, f)
 
 
     def purge(self):
@@ -0,0 +1,77 @@
+import json
+import os
+
+import numpy as np
+
+# value of a normalized intensity of 1 in the storage dtype
+COMPACT_SCALES = {"uint8": 255.0, "float16": 1.0}
+
+
+def get_compact_path(data_path):
+    return data_path.rstrip("/") + "_compact.json"
+
+
+def read_compact_dtype(data_path):
+    """
+    :return: the storage dtype of a directory written with a compact storage_dtype, None for regular float data
+    """
+    path = get_compact_path(data_path)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)["dtype"]
+
+
+def write_compact_metadata(data_path, storage_dtype, metadata):
+    # the original intensity range of every file, to map normalized values back if needed
+    with open(get_compact_path(data_path), "w") as f:
+        json.dump({"dtype": storage_dtype, "files": metadata}, f)
+
+
+def encode_volume(volume, storage_dtype):
+    """
+    Min-max normalize volume and store it in storage_dtype, uint8 quantizes the normalized range to 0..255.
+    :return: the encoded volume and the intensity range of the original
+    """
+    assert storage_dtype in COMPACT_SCALES, "unknown storage dtype {}".format(storage_dtype)
+
+    v_min, v_max = float(volume.min()), float(volume.max())
+    normalized = (volume - v_min) / (v_max - v_min)
+
+    if storage_dtype == "uint8":
+        encoded = np.rint(normalized * COMPACT_SCALES[storage_dtype]).astype(np.uint8)
+    else:
+        encoded = normalized.astype(np.float16)
+
+    return encoded, {"min": v_min, "max": v_max}
+
+
+def save_volume(path, volume, storage_dtype=None):
+    """
+    Save volume as is, or encoded in a compact storage_dtype.
+    :return: the intensity range of the original for the metadata, None without storage_dtype
+    """
+    if storage_dtype is None:
+        np.save(path, volume)
+        return None
+
+    encoded, value_range = encode_volume(volume, storage_dtype)
+    np.save(path, encoded)
+    return value_range
+
+
+def decode_compact(x, storage_dtype):
+    """
+    Convert a compact batch to normalized float32. Preprocessing that only moves values around (crops, patches,
+    permutations, flips, zero padding) may run before, also if it changed the dtype on the way.
+    """
+    if isinstance(x, list):
+        return [decode_compact(e, storage_dtype) for e in x]
+
+    x = np.asarray(x).astype(np.float32)
+    scale = COMPACT_SCALES[storage_dtype]
+    if scale != 1.0:
+        x /= np.float32(scale)
+
+    return x
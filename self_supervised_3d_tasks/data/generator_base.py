@@ -1,42 +1,95 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
 import numpy as np
 import random
 import tensorflow.keras as keras
 
-from self_supervised_3d_tasks.data.preproc_negative_sampling import NegativeSamplingPreprocessing
+from self_supervised_3d_tasks.data.compact_dtype import decode_compact
+from self_supervised_3d_tasks.data.lazy_volume import materialize
+from self_supervised_3d_tasks.data.locality_shuffle import locality_shuffle
+from self_supervised_3d_tasks.data.quarantine import add_to_quarantine, read_quarantine
+from self_supervised_3d_tasks.data.readahead import FileReadahead
+from self_supervised_3d_tasks.data.shape_buckets import bucket_shape, plan_buckets
+from self_supervised_3d_tasks.data.preproc_negative_sampling import (
+    NegativeSamplingPreprocessing,
+    IndexedNegativeSampler,
+)
+from self_supervised_3d_tasks.preprocessing.utils.rng import make_sample_rngs
 
 
 class DataGeneratorBase(keras.utils.Sequence):
+    # storage dtype of the batches returned by data_generation, None if they are already normalized floats
+    compact_dtype = None
+    # number of samples data_generation returns for every file, e.g. sub-volumes of one scan
+    samples_per_file = 1
+    # data_generation draws random numbers itself and takes the random stream of every file (rngs=...)
+    data_generation_takes_rngs = False
+
     def __init__(self,
                  file_list,
                  batch_size,
                  shuffle,
                  pre_proc_func,
-                 use_realistic_batch_size=True):
+                 use_realistic_batch_size=True,
+                 preprocessing_cache_size=4,
+                 seed=None,
+                 shuffle_block_size=None,
+                 shuffle_buffer_size=None,
+                 shape_bucket_size=None,
+                 readahead_files=0,
+                 readahead_threads=2):
         super(DataGeneratorBase, self).__init__()
 
+        # with a seed, every file gets its own random stream per epoch and the file order is seeded as well
+        self.seed = seed
+        self.epoch = 0
         self.use_realistic_batch_size = use_realistic_batch_size
+        self.preprocessing_cache_size = preprocessing_cache_size
+        self.preprocessing_cache = OrderedDict()
+        self.preprocessing_cache_lock = threading.Lock()  # batches can be built in several threads (tf.data)
         self.batch_size = batch_size
         self.list_IDs = file_list
-        self.shuffle = shuffle
-        self.on_epoch_end()
+        # without block or buffer size every epoch reads the files in a fully random order
+        self.shuffle_block_size = shuffle_block_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.storage_order = self.get_storage_order(file_list)
+        self.quarantined = set()  # files that failed to load during training
+        # with a bucket size, files of different shapes are batched by bucket and padded to it
+        self.file_buckets = None
+        self.pad_shapes = None
+        if shape_bucket_size:
+            self.file_buckets = {file_name: bucket_shape(shape, shape_bucket_size)
+                                 for file_name, shape in self.get_file_shapes(file_list).items()}
+        # the files of the next batches are read in background threads while a batch is preprocessed
+        self.readahead_files = readahead_files
+        self.readahead = FileReadahead(readahead_threads) if readahead_files > 0 else None
         self.index_multiplicator = None
         self.pre_proc_func = pre_proc_func
+        self.negative_sampler = None
 
         if isinstance(self.pre_proc_func, NegativeSamplingPreprocessing):
-            def neg_sampling(positive_ids):
-                neg_ids = [e for e in self.list_IDs if e not in positive_ids]
-                idx = np.random.randint(len(neg_ids))
-                x, y = self.data_generation([neg_ids[idx]])
+            self.negative_sampler = IndexedNegativeSampler(self, self.pre_proc_func.pool_size)
 
-                return x[0], y[0]
-
-            self.pre_proc_func.set_negative_sampling(neg_sampling)
+        self.shuffle = shuffle
+        self.on_epoch_end()
 
         assert len(file_list) > 0, "received no files"
 
     def get_multiplicator(self):
-        # check how many examples preprocess produces for one file
-        self.index_multiplicator = DataGeneratorBase.get_batch_size(self.__data_generation_intern([self.list_IDs[0]])[0])
+        if self.pre_proc_func is None:
+            self.index_multiplicator = self.samples_per_file
+        else:
+            self.index_multiplicator = getattr(self.pre_proc_func, "samples_per_input", None)
+            if self.index_multiplicator is not None:
+                self.index_multiplicator *= self.samples_per_file
+
+        if self.index_multiplicator is None:
+            # fallback for undescribed preprocessing: check how many examples preprocess produces for one file
+            self.index_multiplicator = DataGeneratorBase.get_batch_size(
+                self.__data_generation_intern([self.list_IDs[0]], [0])[0])
+
         assert self.index_multiplicator > 0, "invalid preprocessing"
 
     def __len__(self):
@@ -65,6 +118,16 @@ class DataGeneratorBase(keras.utils.Sequence):
         else:
             return x[start:end]
 
+    @staticmethod
+    def concat_input(parts):
+        if len(parts) == 1:
+            return parts[0]
+
+        if isinstance(parts[0], list):
+            return [np.concatenate([p[i] for p in parts]) for i in range(len(parts[0]))]
+        else:
+            return np.concatenate(parts)
+
     def __getitem__(self, index):
         if not self.use_realistic_batch_size:
             index_start = index * self.batch_size  # inc
@@ -74,8 +137,9 @@ class DataGeneratorBase(keras.utils.Sequence):
                 # last batch
                 index_end = len(self.list_IDs)
 
+            self.read_ahead(index_end)
             list_files_temp = [self.list_IDs[k] for k in range(index_start, index_end)]
-            X, Y = self.__data_generation_intern(list_files_temp)
+            X, Y = self.__data_generation_intern(list_files_temp, range(index_start, index_end))
             return X, Y
 
         if self.index_multiplicator is None:
@@ -91,11 +155,15 @@ class DataGeneratorBase(keras.utils.Sequence):
 
         file_start = int(np.floor(index_start / self.index_multiplicator))
         file_end = int(np.floor((index_end - 1) / self.index_multiplicator))
+        self.read_ahead(file_end + 1)
+
+        if self.index_multiplicator > 1 and self.preprocessing_cache_size > 0:
+            return self.__get_samples_cached(file_start, file_end, index_start, index_end)
 
         relative_start = index_start % self.index_multiplicator
 
         list_files_temp = [self.list_IDs[k] for k in range(file_start, file_end + 1)]
-        X, Y = self.__data_generation_intern(list_files_temp)
+        X, Y = self.__data_generation_intern(list_files_temp, range(file_start, file_end + 1))
 
         relative_end = relative_start + self.batch_size
 
@@ -107,22 +175,209 @@ class DataGeneratorBase(keras.utils.Sequence):
 
         return X, Y
 
+    def __get_samples_cached(self, file_start, file_end, index_start, index_end):
+        # every file is preprocessed on its own and kept until all of its samples were served,
+        # so batches cutting across a file do not load and preprocess it again. Only batches requested
+        # close together share the cache, keras has to be told not to shuffle the batch order (shuffle=False),
+        # the generator shuffles its files itself.
+        xs = []
+        ys = []
+
+        for k in range(file_start, file_end + 1):
+            start = max(index_start - k * self.index_multiplicator, 0)
+            end = min(index_end - k * self.index_multiplicator, self.index_multiplicator)
+
+            with self.preprocessing_cache_lock:
+                entry = self.preprocessing_cache.get(k)
+                is_owner = entry is None
+                if is_owner:
+                    # registered before preprocessing, threads requesting the same file wait for this one
+                    entry = [Future(), self.index_multiplicator]
+                    self.preprocessing_cache[k] = entry
+                    self.__evict_cached()
+                else:
+                    self.preprocessing_cache.move_to_end(k)
+
+            if is_owner:
+                try:
+                    entry[0].set_result(self.__data_generation_intern([self.list_IDs[k]], [k]))
+                except Exception as e:
+                    entry[0].set_exception(e)
+                    with self.preprocessing_cache_lock:
+                        if self.preprocessing_cache.get(k) is entry:
+                            del self.preprocessing_cache[k]
+                    raise
+
+            x, y = entry[0].result()
+            xs.append(DataGeneratorBase.slice_input(x, start, end))
+            ys.append(DataGeneratorBase.slice_input(y, start, end))
+
+            with self.preprocessing_cache_lock:
+                entry[1] -= end - start
+                if entry[1] <= 0 and self.preprocessing_cache.get(k) is entry:
+                    del self.preprocessing_cache[k]
+
+        return DataGeneratorBase.concat_input(xs), DataGeneratorBase.concat_input(ys)
+
+    def __evict_cached(self):
+        # least recently used files first, files still being preprocessed have waiting threads and are kept
+        finished = [k for k, entry in self.preprocessing_cache.items() if entry[0].done()]
+        for k in finished[:max(len(self.preprocessing_cache) - self.preprocessing_cache_size, 0)]:
+            del self.preprocessing_cache[k]
+
     def on_epoch_end(self):
         # TODO: see issue: https://github.com/tensorflow/tensorflow/issues/35911 -- in fixing
         super(DataGeneratorBase, self).on_epoch_end()
-        if self.shuffle:
-            # shuffle the files
+        self.preprocessing_cache.clear()
+        self.epoch += 1
+        if self.readahead is not None:
+            self.readahead.reset()
+        if self.negative_sampler is not None:
+            self.negative_sampler.reset()
+        if self.get_data_dir() is not None:
+            # files that failed in the prefetching workers of the last epoch, the next workers start from this
+            self.quarantined |= read_quarantine(self.get_data_dir())
+        if self.file_buckets is not None:
+            self.list_IDs, self.pad_shapes = plan_buckets(self.file_buckets, self.batch_size, self.get_epoch_rng(),
+                                                          self.shuffle)
+        elif self.shuffle:
+            self.shuffle_files()
+
+    def get_epoch_rng(self):
+        # seeded random stream for the file order of the current epoch, None without a seed
+        if self.seed is None:
+            return None
+
+        return np.random.default_rng([self.seed, self.epoch])
+
+    def is_locality_shuffle(self):
+        return bool(self.shuffle_block_size or self.shuffle_buffer_size)
+
+    def get_storage_order(self, file_list):
+        # order in which the files are laid out on disk, written sequentially under increasing names
+        return sorted(file_list)
+
+    def load_healthy(self, load, file_name):
+        """
+        Call load(file_name). A file that fails to load is quarantined and replaced by the next healthy file
+        in storage order, so the batch keeps its size. The failure is added to the quarantine list of the data
+        directory, so prefetching workers of later epochs and later runs skip the file as well.
+        """
+        if file_name in self.quarantined:
+            file_name = self.get_replacement(file_name)
+
+        while True:
+            try:
+                return load(file_name)
+            except Exception as e:
+                print("Error while loading {}, it is quarantined and replaced: {}".format(file_name, e))
+                self.quarantined.add(file_name)
+                self.persist_quarantine(file_name, e)
+                file_name = self.get_replacement(file_name)
+
+    def persist_quarantine(self, file_name, error):
+        if self.get_data_dir() is None:
+            return
+
+        try:
+            add_to_quarantine(self.get_data_dir(), file_name, error)
+        except OSError as e:
+            # e.g. a read-only dataset mount, the file stays quarantined in this process
+            print("Could not add {} to the quarantine list: {}".format(file_name, e))
+
+    def get_data_dir(self):
+        # directory whose quarantine list records files failing during training, None keeps them in memory only
+        return None
+
+    def get_replacement(self, file_name):
+        position = self.storage_order.index(file_name)
+        for k in range(1, len(self.storage_order)):
+            candidate = self.storage_order[(position + k) % len(self.storage_order)]
+            if candidate not in self.quarantined:
+                return candidate
+
+        raise ValueError("no file of this generator can be loaded")
+
+    def get_file_paths(self, file_name):
+        # files read by data_generation for file_name, the generator does not read ahead without them
+        return []
+
+    def read_ahead(self, next_file):
+        if self.readahead is None:
+            return
+
+        upcoming = self.list_IDs[next_file:next_file + self.readahead_files]
+        self.readahead.request([path for file_name in upcoming for path in self.get_file_paths(file_name)])
+
+    def get_file_shapes(self, file_list):
+        raise NotImplementedError("shape buckets are not supported by " + type(self).__name__)
+
+    def shuffle_files(self):
+        rng = self.get_epoch_rng()
+        if self.is_locality_shuffle():
+            self.list_IDs = locality_shuffle(self.storage_order, self.shuffle_block_size, self.shuffle_buffer_size,
+                                             rng)
+        elif rng is None:
             random.shuffle(self.list_IDs)
-
-    def __data_generation_intern(self, list_files_temp):
-        data_x, data_y = self.data_generation(list_files_temp)
+        else:
+            rng.shuffle(self.list_IDs)
+
+    def get_sample_rngs(self, file_indices):
+        # one random stream for every file, None lets the preprocessing draw from the global random state
+        if self.seed is None:
+            return None
+
+        return make_sample_rngs(self.seed, self.epoch, file_indices)
+
+    def __data_generation_intern(self, list_files_temp, file_indices):
+        # layout-only preprocessing works on the compact data, it is converted to float32 once the batch is finished
+        decode_late = self.compact_dtype is not None and getattr(self.pre_proc_func, "layout_only",
+                                                                  self.pre_proc_func is None)
+        # the loader draws from the stream of a file first, the preprocessing continues it
+        rngs = self.get_sample_rngs(file_indices)
+        if decode_late:
+            data_x, data_y = self.load_files(list_files_temp, rngs)
+        else:
+            data_x, data_y = self.data_generation_decoded(list_files_temp, rngs)
 
         if self.pre_proc_func:
+
+            if self.samples_per_file > 1:
+                # the preprocessing sees every sample of a file with the id and random stream of that file
+                list_files_temp = [f for f in list_files_temp for _ in range(self.samples_per_file)]
+                if rngs is not None:
+                    rngs = [rng for rng in rngs for _ in range(self.samples_per_file)]
+
             if isinstance(self.pre_proc_func, NegativeSamplingPreprocessing):
-                data_x, data_y = self.pre_proc_func.preprocess_function(list_files_temp, data_x, data_y)
+                # train and validation generators share the preprocessing, draw negatives from this generator
+                data_x, data_y = self.pre_proc_func.preprocess_function(list_files_temp, data_x, data_y,
+                                                                        self.negative_sampler, rngs=rngs)
+            elif getattr(self.pre_proc_func, "takes_rngs", False):
+                data_x, data_y = self.pre_proc_func(data_x, data_y, rngs=rngs)
             else:
                 data_x, data_y = self.pre_proc_func(data_x, data_y)
 
+        # lazily loaded volumes that were not cropped by the preprocessing are read in full here
+        data_x = materialize(data_x)
+
+        if decode_late:
+            data_x = decode_compact(data_x, self.compact_dtype)
+
+        return data_x, data_y
+
+    def load_files(self, list_files_temp, rngs=None):
+        if self.data_generation_takes_rngs:
+            return self.data_generation(list_files_temp, rngs=rngs)
+
+        return self.data_generation(list_files_temp)
+
+    def data_generation_decoded(self, list_files_temp, rngs=None):
+        # normalized float batches, also if the generator stores them in a compact dtype
+        data_x, data_y = self.load_files(list_files_temp, rngs)
+
+        if self.compact_dtype is not None:
+            data_x = decode_compact(data_x, self.compact_dtype)
+
         return data_x, data_y
 
     def data_generation(self, list_files_temp):
@@ -14,39 +14,44 @@ class DataGeneratorUnlabeled2D(DataGeneratorBase):
                  shuffle=False,
                  pre_proc_func=None,
                  augment=False,
-                 augment_zoom_only=False):
+                 augment_zoom_only=False,
+                 **kwargs):
         self.augment_zoom_only = augment_zoom_only
         self.augment = augment
         self.path_to_data = data_path
 
-        super(DataGeneratorUnlabeled2D, self).__init__(file_list, batch_size, shuffle, pre_proc_func)
+        super(DataGeneratorUnlabeled2D, self).__init__(file_list, batch_size, shuffle, pre_proc_func, **kwargs)
+
+    def get_data_dir(self):
+        return self.path_to_data
+
+    def get_file_paths(self, file_name):
+        return ["{}/{}".format(self.path_to_data, file_name)]
+
+    def load_image(self, file_name):
+        im_frame = Image.open("{}/{}".format(self.path_to_data, file_name))
+        img = np.asarray(im_frame, dtype="float32")
+        img /= 255
+        return img
 
     def data_generation(self, list_files_temp):
         data_x = []
         data_y = []
 
         for file_name in list_files_temp:
-            path_to_image = "{}/{}".format(self.path_to_data, file_name)
-
-            try:
-                im_frame = Image.open(path_to_image)
-                img = np.asarray(im_frame, dtype="float32")
-                img /= 255
-
-                if self.augment_zoom_only:
-                    img = random_zoom(img, zoom_range=(0.85, 1.15), channel_axis=2, row_axis=0, col_axis=1,
-                                      fill_mode='constant', cval=0.0)
-                elif self.augment:
-                    img = random_zoom(img, zoom_range=(0.85, 1.15), channel_axis=2, row_axis=0, col_axis=1,
-                                        fill_mode='constant', cval=0.0)
-                    img = ab.HorizontalFlip()(image=img)["image"]
-                    img = ab.VerticalFlip()(image=img)["image"]
-
-                data_x.append(img)
-                data_y.append(0)
-            except:
-                print("Error while loading image {}.".format(path_to_image))
-                continue
+            img = self.load_healthy(self.load_image, file_name)
+
+            if self.augment_zoom_only:
+                img = random_zoom(img, zoom_range=(0.85, 1.15), channel_axis=2, row_axis=0, col_axis=1,
+                                  fill_mode='constant', cval=0.0)
+            elif self.augment:
+                img = random_zoom(img, zoom_range=(0.85, 1.15), channel_axis=2, row_axis=0, col_axis=1,
+                                    fill_mode='constant', cval=0.0)
+                img = ab.HorizontalFlip()(image=img)["image"]
+                img = ab.VerticalFlip()(image=img)["image"]
+
+            data_x.append(img)
+            data_y.append(0)
 
         data_x = np.stack(data_x)
         data_y = np.stack(data_y)
@@ -0,0 +1,51 @@
+import json
+import os
+
+import numpy as np
+
+
+def get_stats_path(data_path):
+    # next to the data directory, so listing the directory does not pick it up as a sample
+    return data_path.rstrip("/") + "_stats.json"
+
+
+def read_intensity_stats(data_path):
+    """
+    Load the per-file statistics written by data_util/compute_intensity_stats.py.
+    :return: dict from file name to its statistics, None if the data has not been indexed
+    """
+    path = get_stats_path(data_path)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)["files"]
+
+
+def get_intensity_bounds(data_path, intensity_stats):
+    # normalization bounds keyed by the full path of every indexed file, as used by open_volume
+    if intensity_stats is None:
+        return {}
+
+    return {
+        "{}/{}".format(data_path, file_name): (stats["min"], stats["max"])
+        for file_name, stats in intensity_stats.items()
+    }
+
+
+def normalize_volume(img, stats=None):
+    """
+    Min-max normalize img. With stats of the file, the bounds come from the index and floating point
+    volumes are normalized in place, otherwise they are computed from img.
+    """
+    if stats is None:
+        v_min, v_max = img.min(), img.max()
+    else:
+        v_min, v_max = img.dtype.type(stats["min"]), img.dtype.type(stats["max"])
+
+    if not np.issubdtype(img.dtype, np.floating) or not img.flags.writeable:
+        return (img - v_min) / (v_max - v_min)
+
+    img -= v_min
+    img /= v_max - v_min
+    return img
@@ -0,0 +1,17 @@
+import os
+
+import numpy as np
+
+CACHE_IMAGES = "images.npy"
+CACHE_BUILT = "built.npy"
+
+
+def open_image_cache(cache_path):
+    """
+    Memory-map a decoded-image cache written by data_util/build_kaggle_image_cache.py.
+    :return: uint8 images indexed by CSV row and a mask of the rows that are already decoded. The builder
+    can still be running, rows are read from the cache as soon as they are marked.
+    """
+    images = np.load(os.path.join(cache_path, CACHE_IMAGES), mmap_mode="r")
+    built = np.load(os.path.join(cache_path, CACHE_BUILT), mmap_mode="r")
+    return images, built
@@ -5,11 +5,13 @@ import cv2
 import numpy as np
 import pandas as pd
 from PIL import Image
-from sklearn.utils import resample
 from tensorflow.python.keras.preprocessing.image import random_zoom
 
 from self_supervised_3d_tasks.data.generator_base import DataGeneratorBase
+from self_supervised_3d_tasks.data.kaggle_image_cache import open_image_cache
 from self_supervised_3d_tasks.data.make_data_generator import get_data_generators_internal, make_cross_validation
+from self_supervised_3d_tasks.data.quarantine import read_quarantine
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
 
 
 class KaggleGenerator(DataGeneratorBase):
@@ -23,7 +25,11 @@ class KaggleGenerator(DataGeneratorBase):
             suffix=".jpeg",
             pre_proc_func=None,
             multilabel=False,
-            augment=False):
+            augment=False,
+            image_cache=None,
+            class_balanced=False,
+            samples_per_epoch=None,
+            **kwargs):
 
         self.augment = augment
         self.multilabel = multilabel
@@ -31,11 +37,49 @@ class KaggleGenerator(DataGeneratorBase):
         self.dataset = dataset_table
         self.base_path = Path(data_path)
 
-        super().__init__(file_list, batch_size, shuffle, pre_proc_func)
+        # looked up once, pandas indexing per sample is slow for big batches
+        self.image_paths = np.array([str((self.base_path / name).with_suffix(suffix)) for name in dataset_table.iloc[:, 0]])
+        self.labels = dataset_table.iloc[:, 1].to_numpy()
+        self.rows = dataset_table.index.to_numpy()
+
+        # rows whose image failed the prescan of the image directory
+        quarantine = read_quarantine(data_path)
+        file_list = [i for i in file_list if Path(self.image_paths[i]).name not in quarantine]
+
+        self.cache_images, self.cache_built = None, None
+        if image_cache:
+            self.cache_images, self.cache_built = open_image_cache(image_cache)
+
+        # class balancing draws the rows of every epoch with replacement, each class with the same probability
+        self.source_files = np.array(file_list)
+        self.samples_per_epoch = samples_per_epoch or len(file_list)
+        self.sampling_weights = None
+        if class_balanced:
+            self.sampling_weights = get_balanced_weights(self.labels[self.source_files])
+
+        super().__init__(file_list, batch_size, shuffle, pre_proc_func, **kwargs)
+
+    def on_epoch_end(self):
+        super().on_epoch_end()
+
+        if self.sampling_weights is not None:
+            rng = as_generator(self.get_epoch_rng())
+            drawn = rng.choice(len(self.source_files), self.samples_per_epoch, True, self.sampling_weights)
+            self.list_IDs = list(self.source_files[drawn])
+
+    def get_file_paths(self, index):
+        if self.cache_images is not None and self.cache_built[self.rows[index]]:
+            return []
+
+        return [self.image_paths[index]]
 
     def load_image(self, index):
-        path = self.base_path / self.dataset.iloc[index][0]
-        image = Image.open(path.with_suffix(self.suffix))
+        if self.cache_images is not None:
+            row = self.rows[index]  # the row in the csv file, also after shuffling the table
+            if self.cache_built[row]:
+                return self.cache_images[row].astype("float32") / 255.0
+
+        image = Image.open(self.image_paths[index])
 
         arr = np.array(image, dtype="float32")
         arr = arr / 255.0
@@ -47,45 +91,31 @@ class KaggleGenerator(DataGeneratorBase):
 
         for c in list_files_temp:
             image = self.load_image(c)
-            label = self.dataset.iloc[c][1]
 
             if self.augment:
                 image = random_zoom(image, zoom_range=(0.85, 1.15), channel_axis=2, row_axis=0, col_axis=1, fill_mode='constant', cval=0.0)
                 image = ab.HorizontalFlip()(image=image)["image"]
                 image = ab.VerticalFlip()(image=image)["image"]
 
-            if self.multilabel:
-                if label == 0:
-                    label = [1, 0, 0, 0, 0]
-                elif label == 1:
-                    label = [1, 1, 0, 0, 0]
-                elif label == 2:
-                    label = [1, 1, 1, 0, 0]
-                elif label == 3:
-                    label = [1, 1, 1, 1, 0]
-                elif label == 4:
-                    label = [1, 1, 1, 1, 1]
-                label = np.array(label)
-
             data_x.append(image)
-            data_y.append(label)
 
         data_x = np.stack(data_x)
-        data_y = np.stack(data_y)
+        data_y = self.labels[list_files_temp]
+
+        if self.multilabel:
+            # ordinal encoding, label k => k + 1 leading ones (2 => [1, 1, 1, 0, 0])
+            data_y = (np.arange(5)[np.newaxis, :] <= data_y[:, np.newaxis]).astype(np.int)
 
         return data_x, data_y
 
-def __prepare_dataset(csv_file, sample_classes_uniform, shuffle_before_split):
-    dataset = pd.read_csv(csv_file)
+def get_balanced_weights(labels):
+    # probability of drawing every row, so every class is drawn equally often
+    classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    return 1.0 / (len(classes) * counts[inverse])
 
-    if sample_classes_uniform:
-        df_majority = dataset[dataset.level == 0]
-        df_minorities = [dataset[dataset.level == i] for i in range(1, 5)]
-        df_minorities = [resample(minority, replace=True, n_samples=len(df_majority))
-                         for minority in df_minorities]
 
-        dataset = pd.concat([df_majority] + df_minorities)
-        dataset = dataset.sample(frac=1)  # dont make them appear in order
+def __prepare_dataset(csv_file, shuffle_before_split):
+    dataset = pd.read_csv(csv_file)
 
     if shuffle_before_split:
         dataset = dataset.sample(frac=1)
@@ -100,21 +130,27 @@ def get_kaggle_cross_validation(data_path, csv_file, sample_classes_uniform=Fals
                         val_data_generator_args={},
                         shuffle_before_split=False,
                         **kwargs):
-    file_list, dataset = __prepare_dataset(csv_file, sample_classes_uniform, shuffle_before_split)
+    file_list, dataset = __prepare_dataset(csv_file, shuffle_before_split)
+    defaults = {"dataset_table": dataset}
+    # only the training rows are balanced, validation and test see every row once
+    train_defaults = {**defaults, "class_balanced": sample_classes_uniform}
 
     return make_cross_validation(data_path, KaggleGenerator, k_fold=k_fold, files=file_list,
-                            train_data_generator_args={**{"dataset_table": dataset}, **train_data_generator_args},
-                            test_data_generator_args={**{"dataset_table": dataset}, **test_data_generator_args},
-                            val_data_generator_args={**{"dataset_table": dataset}, **val_data_generator_args},
+                            train_data_generator_args={**train_defaults, **train_data_generator_args},
+                            test_data_generator_args={**defaults, **test_data_generator_args},
+                            val_data_generator_args={**defaults, **val_data_generator_args},
                             shuffle_before_split=False,  # dont shuffle again
                             **kwargs)
 
 def get_kaggle_generator(data_path, csv_file, sample_classes_uniform=False, train_split=None, val_split=None, train_data_generator_args={},
                          test_data_generator_args={}, val_data_generator_args={}, shuffle_before_split=False, **kwargs):
-    file_list, dataset = __prepare_dataset(csv_file, sample_classes_uniform, shuffle_before_split)
+    file_list, dataset = __prepare_dataset(csv_file, shuffle_before_split)
+    defaults = {"dataset_table": dataset}
+    # only the training rows are balanced, validation and test see every row once
+    train_defaults = {**defaults, "class_balanced": sample_classes_uniform}
 
     return get_data_generators_internal(data_path, file_list, KaggleGenerator, train_split=train_split, val_split=val_split,
-                        train_data_generator_args={**{"dataset_table": dataset}, **train_data_generator_args},
-                        test_data_generator_args={**{"dataset_table": dataset}, **test_data_generator_args},
-                        val_data_generator_args={**{"dataset_table": dataset}, **val_data_generator_args},
+                        train_data_generator_args={**train_defaults, **train_data_generator_args},
+                        test_data_generator_args={**defaults, **test_data_generator_args},
+                        val_data_generator_args={**defaults, **val_data_generator_args},
                         **kwargs)
\ No newline at end of file
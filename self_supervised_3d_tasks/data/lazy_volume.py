@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class LazyVolume:
+    """
+    A memory-mapped volume that is min-max normalized on access. Slicing reads and normalizes only the
+    requested region, so crops and patches never pull the rest of the volume from disk.
+    Without bounds, regions are returned as stored.
+    """
+
+    def __init__(self, data, v_min, v_max):
+        self.data = data
+        self.v_min = v_min
+        self.v_max = v_max
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        region = np.asarray(self.data[key])
+        if self.v_min is None:
+            return region
+
+        return (region - self.v_min) / (self.v_max - self.v_min)
+
+    def __array__(self, dtype=None):
+        volume = self[...]
+        if dtype is not None:
+            volume = volume.astype(dtype, copy=False)
+        return volume
+
+    def copy(self):
+        return self[...]
+
+
+class LazyBatch:
+    """
+    A batch of lazy volumes. Iterating or indexing with an integer yields the volumes without reading them,
+    everything else materializes the whole batch.
+    """
+
+    def __init__(self, volumes):
+        self.volumes = volumes
+
+    @property
+    def shape(self):
+        return (len(self.volumes),) + tuple(self.volumes[0].shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return len(self.volumes)
+
+    def __iter__(self):
+        return iter(self.volumes)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.volumes[key]
+
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None):
+        batch = np.stack([np.asarray(v) for v in self.volumes])
+        if dtype is not None:
+            batch = batch.astype(dtype, copy=False)
+        return batch
+
+    def copy(self):
+        return np.asarray(self)
+
+
+def open_volume(path, bounds_cache, normalize=True):
+    """
+    Memory-map the volume at path. The normalization bounds need one full pass over the file, so they are
+    computed on first access and kept in bounds_cache for the following epochs.
+    """
+    data = np.load(path, mmap_mode="r")
+    if not normalize:
+        return LazyVolume(data, None, None)
+
+    if path not in bounds_cache:
+        bounds_cache[path] = (data.min(), data.max())
+
+    v_min, v_max = bounds_cache[path]
+    return LazyVolume(data, v_min, v_max)
+
+
+def materialize(x):
+    if isinstance(x, (LazyVolume, LazyBatch)):
+        return np.asarray(x)
+    elif isinstance(x, list):
+        return [materialize(e) for e in x]
+
+    return x
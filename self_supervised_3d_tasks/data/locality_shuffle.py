@@ -0,0 +1,41 @@
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
+
+
+def shuffle_blocks(files, block_size, rng=None):
+    """
+    Shuffle the order of blocks of consecutive files, the files inside a block keep their order.
+    :param files: files in the order they are stored
+    :param block_size: number of consecutive files read as one block
+    :return: list of the shuffled files
+    """
+    rng = as_generator(rng)
+    blocks = [files[i:i + block_size] for i in range(0, len(files), block_size)]
+    return [f for k in rng.permutation(len(blocks)) for f in blocks[int(k)]]
+
+
+def shuffle_windows(files, window_size, rng=None):
+    """
+    Shuffle the files inside windows of consecutive positions. No file moves further than window_size,
+    so the files read at the same time stay close to each other on disk.
+    :param files: files in read order
+    :param window_size: number of consecutive files shuffled among each other
+    :return: list of the shuffled files
+    """
+    rng = as_generator(rng)
+    result = []
+    for i in range(0, len(files), window_size):
+        window = files[i:i + window_size]
+        result += [window[int(k)] for k in rng.permutation(len(window))]
+
+    return result
+
+
+def locality_shuffle(files, block_size=None, window_size=None, rng=None):
+    # random block order first, then short-range shuffling of the files inside a bounded window
+    files = list(files)
+    if block_size:
+        files = shuffle_blocks(files, block_size, rng)
+    if window_size:
+        files = shuffle_windows(files, window_size, rng)
+
+    return files
@@ -1,8 +1,33 @@
 import os
 import random
 
+from self_supervised_3d_tasks.data.manifest import read_manifest, filter_manifest
+from self_supervised_3d_tasks.data.packed_slices import is_packed, read_packed_index
+from self_supervised_3d_tasks.data.quarantine import read_quarantine
 from self_supervised_3d_tasks.data.segmentation_task_loader import SegmentationGenerator3D
 
+
+def list_files(data_path, file_shape=None):
+    """
+    The files of data_path. With a manifest, they are taken from it in sorted order instead of listing
+    the directory, and files that could not be read or do not have file_shape are left out.
+    Files in the quarantine list of the directory are always left out.
+    """
+    # the files of a packed slice store are listed in its index, not in the directory
+    if is_packed(data_path):
+        return list(read_packed_index(data_path)["files"])
+
+    manifest = read_manifest(data_path)
+    if manifest is not None:
+        files = filter_manifest(manifest, file_shape)
+    else:
+        assert file_shape is None, "filtering by file_shape needs a manifest of {}".format(data_path)
+        files = os.listdir(data_path)
+
+    quarantine = read_quarantine(data_path)
+    return [file_name for file_name in files if file_name not in quarantine]
+
+
 def get_data_generators_internal(data_path, files, data_generator, train_split=None, val_split=None,
                         train_data_generator_args={},
                         test_data_generator_args={},
@@ -101,10 +126,11 @@ def make_cross_validation(data_path, data_generator, k_fold=5, files=None,
                         test_data_generator_args={},
                         val_data_generator_args={},
                         shuffle_before_split=False,
+                        file_shape=None,
                         **kwargs):
     if files is None:
         # List images in directory
-        files = os.listdir(data_path)
+        files = list_files(data_path, file_shape)
 
     if shuffle_before_split:
         random.shuffle(files)
@@ -119,6 +145,7 @@ def get_data_generators(data_path, data_generator, train_split=None, val_split=N
                         test_data_generator_args={},
                         val_data_generator_args={},
                         shuffle_before_split=False,
+                        file_shape=None,
                         **kwargs):
     """
     This function generates the data generator for training, testing and optional validation.
@@ -127,6 +154,7 @@ def get_data_generators(data_path, data_generator, train_split=None, val_split=N
     :param train_split: between 0 and 1, percentage of images used for training
     :param val_split: between 0 and 1, percentage of images used for test, None for no validation set
     :param shuffle_before_split:
+    :param file_shape: only use files of this shape, needs a manifest of data_path
     :param train_data_generator_args: Optional arguments for data generator
     :param test_data_generator_args: Optional arguments for data generator
     :param val_data_generator_args: Optional arguments for data generator
@@ -134,7 +162,7 @@ def get_data_generators(data_path, data_generator, train_split=None, val_split=N
     """
 
     # List images in directory
-    files = os.listdir(data_path)
+    files = list_files(data_path, file_shape)
 
     if shuffle_before_split:
         random.shuffle(files)
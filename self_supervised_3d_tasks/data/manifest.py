@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# label files are named like the image, with one of these stems before the suffix
+LABEL_STEMS = ("", "_label")
+IMAGE_SUFFIXES = (".png", ".jpeg", ".jpg")
+
+
+def get_manifest_path(data_path):
+    # next to the data directory, so listing the directory does not pick it up as a sample
+    return data_path.rstrip("/") + "_manifest.json"
+
+
+def get_label_dir(data_path):
+    return data_path.rstrip("/") + "_labels"
+
+
+def read_manifest(data_path, partial=False):
+    """
+    Load the manifest written by data_util/build_manifest.py.
+    :param partial: also return the manifest of a build that has not finished yet
+    :return: dict from file name to its entry, None if the directory has no (finished) manifest
+    """
+    path = get_manifest_path(data_path)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        manifest = json.load(f)
+
+    if not manifest["complete"] and not partial:
+        return None
+
+    return manifest["files"]
+
+
+def write_manifest(data_path, entries, complete=True):
+    # written to a temporary file first, so an interrupted build never leaves a broken manifest
+    path = get_manifest_path(data_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"complete": complete, "files": entries}, f)
+    os.replace(path + ".tmp", path)
+
+
+def read_shape(path):
+    # only the header is read, .npy files are memory-mapped and images are opened lazily
+    if path.endswith(".npy"):
+        data = np.load(path, mmap_mode="r")
+        return list(data.shape), str(data.dtype)
+
+    if path.lower().endswith(IMAGE_SUFFIXES):
+        with Image.open(path) as img:
+            width, height = img.size
+            return [height, width, len(img.getbands())], "uint8"
+
+    return None, None  # e.g. TFRecord shards, whose samples are described by their records
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def find_label(label_dir, file_name):
+    for stem in LABEL_STEMS:
+        path_label = Path(label_dir) / file_name
+        path_label = path_label.with_name(path_label.stem + stem).with_suffix(path_label.suffix)
+        if path_label.is_file():
+            return path_label
+
+    return None
+
+
+def is_unchanged(entry, stat):
+    return entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+
+def describe_file(data_path, file_name, previous=None, hash_contents=True):
+    """
+    Manifest entry of one file: byte size, modification time, shape, dtype, the paired label file and
+    a content hash. Files that cannot be read get an error instead of a shape.
+    :param previous: entry of the last build, kept if the file did not change since
+    """
+    path = os.path.join(data_path, file_name)
+    stat = os.stat(path)
+    if is_unchanged(previous, stat):
+        return previous
+
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    try:
+        entry["shape"], entry["dtype"] = read_shape(path)
+
+        label_path = find_label(get_label_dir(data_path), file_name)
+        if label_path is not None:
+            entry["label"] = label_path.name
+            entry["label_shape"], _ = read_shape(str(label_path))
+
+        if hash_contents:
+            entry["sha1"] = hash_file(path)
+    except Exception as e:
+        entry["error"] = str(e)
+
+    return entry
+
+
+def filter_manifest(manifest, file_shape=None):
+    """
+    :param manifest: dict from file name to its entry
+    :param file_shape: keep only files of this shape, None keeps every shape
+    :return: sorted names of the readable files
+    """
+    files = []
+    for file_name, entry in manifest.items():
+        if "error" in entry:
+            continue
+        if file_shape is not None and entry["shape"] != list(file_shape):
+            continue
+
+        files.append(file_name)
+
+    return sorted(files)
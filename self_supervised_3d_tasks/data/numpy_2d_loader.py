@@ -1,6 +1,7 @@
 from pathlib import Path
 
 from self_supervised_3d_tasks.data.generator_base import DataGeneratorBase
+from self_supervised_3d_tasks.data.packed_slices import is_packed, open_packed, take_rows
 import numpy as np
 
 class Numpy2DLoader(DataGeneratorBase):
@@ -11,49 +12,85 @@ class Numpy2DLoader(DataGeneratorBase):
                  batch_size=32,
                  shuffle=False,
                  pre_proc_func=None,
-                 n_classes = 3):
+                 n_classes = 3,
+                 sparse_labels=False,
+                 **kwargs):
         self.n_classes = n_classes
+        self.sparse_labels = sparse_labels
         self.path_to_data = data_path
         self.label_dir = data_path + "_labels"
+        self.packed = is_packed(data_path)
 
-        if not Path(self.label_dir).exists():
+        if self.packed:
+            self.images, self.labels, self.rows = open_packed(data_path)
+            self.label_dir = None
+        elif not Path(self.label_dir).exists():
             self.label_dir = None
 
-        super(Numpy2DLoader, self).__init__(file_list, batch_size, shuffle, pre_proc_func)
+        super(Numpy2DLoader, self).__init__(file_list, batch_size, shuffle, pre_proc_func, **kwargs)
 
-    def data_generation(self, list_files_temp):
-        data_x = []
-        data_y = []
+    def get_storage_order(self, file_list):
+        if self.packed:
+            return sorted(file_list, key=lambda file_name: self.rows[file_name])
 
-        for file_name in list_files_temp:
-            path_to_image = "{}/{}".format(self.path_to_data, file_name)
+        return super(Numpy2DLoader, self).get_storage_order(file_list)
+
+    def get_label_path(self, file_name):
+        path_label = Path("{}/{}".format(self.label_dir, file_name))
+        return path_label.with_name(path_label.stem).with_suffix(path_label.suffix)
+
+    def get_data_dir(self):
+        return self.path_to_data
+
+    def get_file_paths(self, file_name):
+        if self.packed:
+            return []  # rows of the memory-mapped arrays
+
+        paths = ["{}/{}".format(self.path_to_data, file_name)]
+        if self.label_dir:
+            paths.append(str(self.get_label_path(file_name)))
 
-            try:
-                if self.label_dir:
-                    path_label = Path("{}/{}".format(self.label_dir, file_name))
-                    path_label = path_label.with_name(path_label.stem).with_suffix(path_label.suffix)
-                    mask = np.load(path_label)
+        return paths
 
-                path_to_image = "{}/{}".format(self.path_to_data, file_name)
-                img = np.load(path_to_image)
+    def data_generation_packed(self, list_files_temp):
+        rows = np.array([self.rows[file_name] for file_name in list_files_temp])
+        data_x = take_rows(self.images, rows)
 
-                data_x.append(img)
+        if self.labels is None:
+            return data_x, np.zeros(len(rows), dtype=np.int)
 
-                if self.label_dir:
-                    data_y.append(mask)
-                else:
-                    data_y.append(0)
+        return data_x, self.encode_labels(take_rows(self.labels, rows))
 
-            except Exception as e:
-                print("Error while loading image {}.".format(path_to_image))
-                continue
+    def encode_labels(self, data_y):
+        if self.sparse_labels:
+            # integer label map, the model one-hots it in the graph
+            return np.rint(data_y).astype(np.uint8)
+
+        data_y = np.rint(data_y).astype(np.int)
+        data_y = np.eye(self.n_classes)[data_y]
+        return np.squeeze(data_y, axis=-2)  # remove second last axis, which is still 1
+
+    def load_file(self, file_name):
+        mask = np.load(self.get_label_path(file_name)) if self.label_dir else 0
+        img = np.load("{}/{}".format(self.path_to_data, file_name))
+        return img, mask
+
+    def data_generation(self, list_files_temp):
+        if self.packed:
+            return self.data_generation_packed(list_files_temp)
+
+        data_x = []
+        data_y = []
+
+        for file_name in list_files_temp:
+            img, mask = self.load_healthy(self.load_file, file_name)
+            data_x.append(img)
+            data_y.append(mask)
 
         data_x = np.stack(data_x)
         data_y = np.stack(data_y)
 
         if self.label_dir:
-            data_y = np.rint(data_y).astype(np.int)
-            data_y = np.eye(self.n_classes)[data_y]
-            data_y = np.squeeze(data_y, axis=-2)  # remove second last axis, which is still 1
+            data_y = self.encode_labels(data_y)
 
         return data_x, data_y
\ No newline at end of file
@@ -1,27 +1,94 @@
 import numpy as np
+from self_supervised_3d_tasks.data.compact_dtype import read_compact_dtype
 from self_supervised_3d_tasks.data.generator_base import DataGeneratorBase
+from self_supervised_3d_tasks.data.intensity_stats import read_intensity_stats, get_intensity_bounds, normalize_volume
+from self_supervised_3d_tasks.data.lazy_volume import LazyBatch, open_volume
+from self_supervised_3d_tasks.data.patch_sampler import sample_patch_offsets, read_patch, check_patch_bounds
+from self_supervised_3d_tasks.data.shape_buckets import read_file_shapes, pad_to_shape
+from self_supervised_3d_tasks.preprocessing.utils.rng import sample_rngs
 
 
 class DataGeneratorUnlabeled3D(DataGeneratorBase):
+    data_generation_takes_rngs = True  # the sub-volumes are placed at random
 
-    def __init__(self, data_path, file_list, batch_size=32, shuffle=True, pre_proc_func=None):
+    def __init__(self, data_path, file_list, batch_size=32, shuffle=True, pre_proc_func=None, use_mmap=False,
+                 patch_shape=None, patches_per_volume=1, foreground_probability=0.0, **kwargs):
         self.path_to_data = data_path
+        self.use_mmap = use_mmap
+        # with a patch shape, every file yields patches_per_volume random sub-volumes instead of the whole scan
+        self.patch_shape = patch_shape
+        self.foreground_probability = foreground_probability
+        if patch_shape is not None:
+            self.samples_per_file = patches_per_volume
+        self.intensity_stats = read_intensity_stats(data_path)
+        self.intensity_bounds = get_intensity_bounds(data_path, self.intensity_stats)
+        self.compact_dtype = read_compact_dtype(data_path)  # compact volumes are stored normalized already
+        if patch_shape is not None and self.compact_dtype is None:
+            check_patch_bounds(data_path, self.intensity_stats)
 
-        super().__init__(file_list, batch_size, shuffle, pre_proc_func)
+        super().__init__(file_list, batch_size, shuffle, pre_proc_func, **kwargs)
+
+    def get_intensity_stats(self, file_name):
+        if self.intensity_stats is None:
+            return None
+
+        return self.intensity_stats.get(file_name)
+
+    def get_file_paths(self, file_name):
+        if self.use_mmap or self.patch_shape is not None:
+            return []  # only the cropped regions are read
+
+        return ["{}/{}".format(self.path_to_data, file_name)]
+
+    def get_file_shapes(self, file_list):
+        return read_file_shapes(self.path_to_data, file_list)
+
+    def data_generation_patches(self, list_files_temp, rngs=None):
+        data_x = []
+
+        for file_name, rng in zip(list_files_temp, sample_rngs(rngs, len(list_files_temp))):
+            img = open_volume("{}/{}".format(self.path_to_data, file_name), self.intensity_bounds,
+                              normalize=self.compact_dtype is None)
+
+            # the foreground bounding box of the intensity statistics
+            stats = self.get_intensity_stats(file_name)
+            foreground = stats["bbox"] if stats is not None and self.foreground_probability > 0 else None
+
+            for offset in sample_patch_offsets(img.shape[:3], self.patch_shape, self.samples_per_file, rng,
+                                               foreground=foreground,
+                                               foreground_probability=self.foreground_probability):
+                data_x.append(read_patch(img, offset, self.patch_shape))
+
+        return np.stack(data_x), np.zeros(len(data_x))
+
+    def data_generation(self, list_files_temp, rngs=None):
+        if self.patch_shape is not None:
+            return self.data_generation_patches(list_files_temp, rngs)
 
-    def data_generation(self, list_files_temp):
         data_x = []
         data_y = []
 
         for file_name in list_files_temp:
             path_to_image = "{}/{}".format(self.path_to_data, file_name)
-            img = np.load(path_to_image)
-            img = (img - img.min()) / (img.max() - img.min())
+
+            if self.use_mmap:
+                # the volume stays on disk, preprocessing only reads the regions it crops
+                img = open_volume(path_to_image, self.intensity_bounds, normalize=self.compact_dtype is None)
+            elif self.compact_dtype is not None:
+                img = np.load(path_to_image)
+            else:
+                img = normalize_volume(np.load(path_to_image), self.get_intensity_stats(file_name))
+
+            if self.pad_shapes is not None:
+                img = pad_to_shape(np.asarray(img), self.pad_shapes[file_name])
 
             data_x.append(img)
             data_y.append(0)  # just to keep the dims right
 
-        data_x = np.stack(data_x)
+        if self.use_mmap and self.pad_shapes is None:
+            data_x = LazyBatch(data_x)
+        else:
+            data_x = np.stack(data_x)
         data_y = np.stack(data_y)
 
         return data_x, data_y
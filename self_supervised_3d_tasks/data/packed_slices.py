@@ -0,0 +1,41 @@
+import json
+import os
+
+import numpy as np
+
+PACKED_INDEX = "index.json"
+PACKED_IMAGES = "images.npy"
+PACKED_LABELS = "labels.npy"
+
+
+def is_packed(data_path):
+    return os.path.isfile(os.path.join(data_path, PACKED_INDEX))
+
+
+def read_packed_index(data_path):
+    with open(os.path.join(data_path, PACKED_INDEX), "r") as f:
+        return json.load(f)
+
+
+def open_packed(data_path):
+    """
+    Memory-map a packed slice store written by data_util/pack_slices.py.
+    :return: images, labels (None if the store has no labels) and a dict from file name to row
+    """
+    index = read_packed_index(data_path)
+
+    images = np.load(os.path.join(data_path, PACKED_IMAGES), mmap_mode="r")
+    labels = None
+    if index["has_labels"]:
+        labels = np.load(os.path.join(data_path, PACKED_LABELS), mmap_mode="r")
+
+    rows = dict(zip(index["files"], index["offsets"]))
+    return images, labels, rows
+
+
+def take_rows(data, rows):
+    # consecutive rows are a view into the memory map, anything else is gathered with one fancy index
+    if len(rows) > 0 and np.all(np.diff(rows) == 1):
+        return np.asarray(data[rows[0]:rows[-1] + 1])
+
+    return np.asarray(data[rows])
@@ -0,0 +1,74 @@
+import numpy as np
+
+from self_supervised_3d_tasks.data.intensity_stats import get_stats_path
+from self_supervised_3d_tasks.data.shape_buckets import pad_to_shape
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
+
+
+def check_patch_bounds(data_path, intensity_stats):
+    """
+    Patches are normalized with the bounds of their whole scan. Without intensity statistics the bounds need a
+    full read of every scan, in every prefetching worker and every epoch, which is what patches avoid.
+    :raises ValueError: if data_path has not been indexed
+    """
+    if intensity_stats is None:
+        raise ValueError("patch_shape needs intensity statistics of {}, write {} with "
+                         "data_util/compute_intensity_stats.py".format(data_path, get_stats_path(data_path)))
+
+
+def foreground_points(mask, max_points=10000):
+    """
+    Coordinates of the labeled voxels of a label map, every n-th one if there are more than max_points.
+    :return: array (points, 3), empty if the map has no foreground
+    """
+    points = np.argwhere(np.asarray(mask)[..., 0] > 0)
+    step = max(len(points) // max_points, 1)
+    return points[::step].astype(np.int32)
+
+
+def draw_foreground_center(foreground, rng):
+    # foreground is either an array of labeled voxels or a bounding box as [start, end) per axis
+    if isinstance(foreground, np.ndarray):
+        if len(foreground) == 0:
+            return None
+        return foreground[int(rng.integers(len(foreground)))]
+
+    if any(end <= start for start, end in foreground):
+        return None
+    return np.array([int(rng.integers(start, end)) for start, end in foreground])
+
+
+def sample_patch_offsets(shape, patch_shape, n_patches, rng=None, foreground=None, foreground_probability=0.0):
+    """
+    Draw the corners of n_patches sub-volumes of patch_shape inside a volume of shape. With probability
+    foreground_probability a patch is centered on the foreground, otherwise it is placed uniformly.
+    :param shape: spatial shape of the volume
+    :param foreground: labeled voxels (see foreground_points) or a foreground bounding box, None samples uniformly
+    :return: list of offsets, patches of volumes smaller than patch_shape start at 0 in that axis
+    """
+    rng = as_generator(rng)
+    max_offset = np.maximum(np.array(shape) - np.array(patch_shape), 0)
+
+    offsets = []
+    for _ in range(n_patches):
+        center = None
+        if foreground is not None and rng.random() < foreground_probability:
+            center = draw_foreground_center(foreground, rng)
+
+        if center is None:
+            offset = np.array([int(rng.integers(m + 1)) for m in max_offset])
+        else:
+            offset = np.clip(center - np.array(patch_shape) // 2, 0, max_offset)
+
+        offsets.append(offset)
+
+    return offsets
+
+
+def read_patch(volume, offset, patch_shape):
+    """
+    Read one sub-volume, lazy volumes only read that region. Patches reaching beyond the volume are zero padded.
+    """
+    region = tuple(slice(o, o + p) for o, p in zip(offset, patch_shape))
+    patch = np.asarray(volume[region])
+    return pad_to_shape(patch, tuple(patch_shape) + patch.shape[3:])
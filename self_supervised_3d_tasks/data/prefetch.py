@@ -0,0 +1,210 @@
+import multiprocessing
+import os
+import random
+from collections import deque
+
+import numpy as np
+
+# offsets of the arrays in a shared batch slot are aligned to this many bytes
+SLOT_ALIGNMENT = 64
+
+_worker_generator = None
+_worker_slots = None
+
+
+def _init_worker(generator, seed, slots=None):
+    global _worker_generator, _worker_slots
+    _worker_generator = generator
+    _worker_slots = slots
+
+    # forked workers inherit the random state of the parent, reseed them so they do not draw the same numbers
+    worker_seed = (seed + os.getpid()) % (2 ** 32)
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def _load_batch(index, slot=None):
+    batch = _worker_generator[index]
+    if slot is None:
+        return None, batch
+
+    layout = write_batch(_worker_slots[slot], batch)
+    if layout is None:
+        return None, batch  # does not fit into the slot, sent pickled instead
+
+    return slot, layout
+
+
+def flatten_batch(batch):
+    # the arrays of a batch (x, y), x and y are a single array or a list of arrays (e.g. CPC's encoder and predictor)
+    arrays = []
+    structure = []
+    for part in batch:
+        if isinstance(part, list):
+            arrays += [np.asarray(a) for a in part]
+            structure.append(len(part))
+        else:
+            arrays.append(np.asarray(part))
+            structure.append(None)
+
+    return arrays, structure
+
+
+def unflatten_batch(arrays, structure):
+    batch = []
+    position = 0
+    for length in structure:
+        if length is None:
+            batch.append(arrays[position])
+            position += 1
+        else:
+            batch.append(arrays[position:position + length])
+            position += length
+
+    return tuple(batch)
+
+
+def get_batch_bytes(batch):
+    arrays, _ = flatten_batch(batch)
+    return sum(a.nbytes + SLOT_ALIGNMENT for a in arrays)
+
+
+def write_batch(buffer, batch):
+    """
+    Copy the arrays of a batch into a shared buffer.
+    :return: structure and (offset, shape, dtype) of every array, None if the batch does not fit
+    """
+    arrays, structure = flatten_batch(batch)
+
+    placements = []
+    offset = 0
+    for a in arrays:
+        placements.append((offset, a.shape, a.dtype.str))
+        offset += int(np.ceil(a.nbytes / SLOT_ALIGNMENT)) * SLOT_ALIGNMENT
+
+    if offset > len(buffer):
+        return None
+
+    for a, (offset, shape, dtype) in zip(arrays, placements):
+        np.frombuffer(buffer, dtype=dtype, count=a.size, offset=offset).reshape(shape)[...] = a
+
+    return structure, placements
+
+
+def read_batch(buffer, layout):
+    # views of the shared buffer, valid until the slot is written again
+    structure, placements = layout
+    arrays = [np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+              for offset, shape, dtype in placements]
+    return unflatten_batch(arrays, structure)
+
+
+class BatchPrefetcher:
+    """
+    Builds the batches of a DataGeneratorBase ahead of time in worker processes.
+    Iterating yields the batches of all epochs in order. The workers of an epoch are shut down
+    before the generator is shuffled for the next one, so every epoch starts from the current file order.
+
+    With shared memory, the workers write the batches into a ring of shared slots instead of pickling them, and
+    the yielded arrays are views of the slot. Tensors made from them can share the memory, and keras holds the
+    batch of the running step and a prefetched one, so a slot is only written again after held_batches more
+    batches have been requested.
+    Batches larger than a slot are pickled as before.
+    """
+
+    def __init__(self, generator, workers=4, max_queue_size=10, shared_memory=True, slot_bytes=None,
+                 held_batches=3):
+        """
+        :param shared_memory: transport the batches through shared memory instead of pickling them
+        :param slot_bytes: size of every shared slot, by default the size of the first batch
+        :param held_batches: number of the last yielded batches whose slots are not written again
+        """
+        assert workers > 0, "prefetching needs at least one worker"
+        assert max_queue_size > 0, "prefetching needs a queue depth of at least one batch"
+
+        self.generator = generator
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.shared_memory = shared_memory
+        self.slot_bytes = slot_bytes
+        self.held_batches = max(held_batches, 1)
+        self.slots = None
+        self.held_slots = deque()  # slots of the last yielded batches, oldest first
+        self.batches = None
+
+    def __len__(self):
+        return len(self.generator)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.batches is None:
+            self.batches = self.epoch()
+
+        try:
+            return next(self.batches)
+        except StopIteration:
+            self.batches = self.epoch()
+            return next(self.batches)
+
+    def make_slots(self):
+        # allocated before the workers are started, so they share the memory with this process
+        slot_bytes = self.slot_bytes or get_batch_bytes(self.generator[0])
+        return [multiprocessing.RawArray("b", slot_bytes) for _ in range(self.max_queue_size + self.held_batches)]
+
+    def epoch(self):
+        n_batches = len(self.generator)  # evaluated before forking, so the workers do not probe again
+        if self.shared_memory and self.slots is None:
+            self.slots = self.make_slots()
+
+        seed = np.random.randint(2 ** 31)
+        pool = multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self.generator, seed, self.slots))
+
+        free_slots = None
+        if self.slots is not None:
+            # the last batches of the previous epoch can still be in use
+            free_slots = deque(k for k in range(len(self.slots)) if k not in self.held_slots)
+
+        finished = False
+        try:
+            pending = deque()
+            next_index = 0
+
+            for _ in range(n_batches):
+                while next_index < n_batches and len(pending) < self.max_queue_size:
+                    slot = None
+                    if free_slots is not None:
+                        slot = free_slots.popleft()
+
+                    pending.append((slot, pool.apply_async(_load_batch, (next_index, slot))))
+                    next_index += 1
+
+                slot, result = pending.popleft()
+                written_slot, payload = result.get()
+
+                if written_slot is None:
+                    batch = payload
+                else:
+                    batch = read_batch(self.slots[written_slot], payload)
+
+                if slot is not None:
+                    self.held_slots.append(slot)
+                    while len(self.held_slots) > self.held_batches:
+                        free_slots.append(self.held_slots.popleft())
+                yield batch
+
+            finished = True
+        finally:
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+        self.generator.on_epoch_end()
+
+    def close(self):
+        if self.batches is not None:
+            self.batches.close()
+            self.batches = None
@@ -1,13 +1,128 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from self_supervised_3d_tasks.data.lazy_volume import materialize
+from self_supervised_3d_tasks.preprocessing.utils.rng import GLOBAL_RANDOM, as_generator
+
+
 class NegativeSamplingPreprocessing:
-    def __init__(self, f_preproc):
+    def __init__(self, f_preproc, pool_size=0):
         self.f_preproc = f_preproc
-        self.f_sample = None
+        self.pool_size = pool_size
+
+    def preprocess_function(self, ids, x, y, sampler, rngs=None):
+        """
+        :param sampler: draws a negative example, sampler(positive_ids, rng). Train and validation generators
+        share this object, every batch passes the sampler of its own generator.
+        """
+        return self.f_preproc(sampler, ids, x, y, rngs=rngs)
+
+
+class IndexedNegativeSampler:
+    """
+    Draws negative examples from the files of a generator. Files are picked by rejection sampling over
+    indices, so a draw does not depend on the size of the dataset. With pool_size > 0 up to pool_size
+    negatives are loaded ahead of time in a background thread, and a draw only blocks on disk if none
+    of them is ready. Draws with a per-sample generator do not depend on the order the loads finish in,
+    they bypass the pool. The pool is shared by the threads building batches and emptied at the end of an epoch.
+    """
+
+    max_rejections = 100
+
+    def __init__(self, generator, pool_size=0):
+        self.generator = generator
+        self.pool_size = pool_size
+        self.pool = []
+        self.executor = None
+        self.executor_pid = None
+        self.rng = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # threads and pending loads can not be sent to another process
+        state = self.__dict__.copy()
+        state.update(pool=[], executor=None, executor_pid=None, rng=None, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        # negatives loaded for the last epoch are dropped, pending loads finish in the background
+        with self.lock:
+            self.pool = []
+            self.rng = None
+
+    def make_pool_rng(self):
+        # the files of the pool, seeded per epoch with the seed of the generator, from fresh entropy without one,
+        # so forked prefetching workers do not draw the same files
+        if self.generator.seed is None:
+            return np.random.default_rng()
+
+        return np.random.default_rng([self.generator.seed, self.generator.epoch])
+
+    def draw_index(self, positive_ids, rng=None):
+        list_IDs = self.generator.list_IDs
+        positive_ids = set(positive_ids)
+        rng = as_generator(rng)
+
+        for _ in range(self.max_rejections):
+            idx = int(rng.integers(len(list_IDs)))
+            if list_IDs[idx] not in positive_ids:
+                return idx
+
+        # almost every file is a positive, fall back to drawing from the remaining ones
+        neg_indices = [k for k, e in enumerate(list_IDs) if e not in positive_ids]
+        assert len(neg_indices) > 0, "no file left to draw a negative example from"
+        return neg_indices[int(rng.integers(len(neg_indices)))]
+
+    def load(self, idx):
+        return self.load_file(self.generator.list_IDs[idx])
+
+    def load_file(self, file_name):
+        x, y = self.generator.data_generation_decoded([file_name])
+        return materialize(x)[0], y[0]
+
+    def __call__(self, positive_ids, rng=None):
+        # unseeded batches pass the global random state, only seeded draws bypass the pool
+        if self.pool_size <= 0 or (rng is not None and rng is not GLOBAL_RANDOM):
+            return self.load(self.draw_index(positive_ids, rng))
+
+        positive_ids = set(positive_ids)
+        with self.lock:
+            self.__fill_pool()
+            candidates = [p for p in self.pool if p[0] not in positive_ids]
+
+            entry = None
+            if len(candidates) > 0:
+                ready = [p for p in candidates if p[1].done()]
+                entry = ready[0] if len(ready) > 0 else candidates[0]
+                self.pool.remove(entry)
+                self.__fill_pool()
+
+        if entry is None:
+            return self.load(self.draw_index(positive_ids))
+
+        return entry[1].result()
 
-    def set_negative_sampling(self, f_sample):
-        self.f_sample = f_sample
+    def __fill_pool(self):
+        # called with the lock held
+        if self.executor_pid != os.getpid():
+            # forked prefetching workers inherit neither the thread nor its results
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            self.executor_pid = os.getpid()
+            self.pool = []
+            self.rng = None
 
-    def draw_neg_sample(self, positive_ids):
-        return self.f_sample(positive_ids)
+        if self.rng is None:
+            self.rng = self.make_pool_rng()
 
-    def preprocess_function(self, ids, x, y):
-        return self.f_preproc(self, ids, x, y)
\ No newline at end of file
+        list_IDs = self.generator.list_IDs
+        while len(self.pool) < self.pool_size:
+            file_name = list_IDs[int(self.rng.integers(len(list_IDs)))]
+            # the file is fixed when it is submitted, the file order can be shuffled before the load runs
+            self.pool.append((file_name, self.executor.submit(self.load_file, file_name)))
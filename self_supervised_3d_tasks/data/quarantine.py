@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from self_supervised_3d_tasks.data.manifest import IMAGE_SUFFIXES
+
+# serializes the threads of this process updating a quarantine list
+_quarantine_lock = threading.Lock()
+
+
+def get_quarantine_path(data_path):
+    # next to the data directory, so listing the directory does not pick it up as a sample
+    return data_path.rstrip("/") + "_quarantine.json"
+
+
+def read_quarantine_errors(data_path):
+    # dict from quarantined file name to its error, empty if the directory was not scanned
+    path = get_quarantine_path(data_path)
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)["files"]
+
+
+def read_quarantine(data_path):
+    """
+    Load the quarantine list written by data_util/prescan_files.py and by files failing during training.
+    :return: set of the quarantined file names, empty if the directory was not scanned
+    """
+    return set(read_quarantine_errors(data_path))
+
+
+def write_quarantine(data_path, errors):
+    # the error of every quarantined file, to see what is wrong with it. Written to a temporary file first,
+    # so a reader never sees a partly written list.
+    path = get_quarantine_path(data_path)
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, "w") as f:
+        json.dump({"files": errors}, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def add_to_quarantine(data_path, file_name, error):
+    """
+    Append a file that failed to load during training to the quarantine list, so later epochs and runs skip it.
+    Threads of one process update the list one after another. Worker processes failing at the same time can
+    overwrite each other's entry, the file is then added again when it fails in the next epoch.
+    :raises OSError: if the list can not be written, e.g. next to a read-only data directory
+    """
+    with _quarantine_lock:
+        errors = read_quarantine_errors(data_path)
+        errors[file_name] = "failed during training: {}".format(error)
+        write_quarantine(data_path, errors)
+
+
+def validate_file(path, expected_shape=None):
+    """
+    Read a file the way the loaders do and check its contents.
+    :param expected_shape: shape every file must have, None accepts any shape
+    :return: None if the file is fine, otherwise the reason it fails
+    """
+    try:
+        if path.endswith(".npy"):
+            data = np.load(path)
+        elif path.lower().endswith(IMAGE_SUFFIXES):
+            with Image.open(path) as img:
+                data = np.asarray(img)
+        else:
+            return None  # not read by the array and image loaders
+    except Exception as e:
+        return "unreadable: {}".format(e)
+
+    if not (np.issubdtype(data.dtype, np.number) or data.dtype == np.bool_):
+        return "dtype {} is not numeric".format(data.dtype)
+    if data.size == 0:
+        return "empty"
+    if expected_shape is not None and tuple(data.shape) != tuple(expected_shape):
+        return "shape {} instead of {}".format(data.shape, tuple(expected_shape))
+    if np.issubdtype(data.dtype, np.floating) and not np.all(np.isfinite(data)):
+        return "contains nan or inf"
+
+    return None
@@ -0,0 +1,63 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# bytes read per call, reading releases the GIL while the kernel copies the data
+READ_CHUNK_SIZE = 1 << 22
+
+
+def read_file(path):
+    """
+    Read a file once and drop the bytes, so it is in the page cache when the loader opens it.
+    Missing or unreadable files are skipped, the loader reports them.
+    """
+    try:
+        buffer = bytearray(READ_CHUNK_SIZE)
+        with open(path, "rb", buffering=0) as f:
+            while f.readinto(buffer) > 0:
+                pass
+    except OSError:
+        pass
+
+
+class FileReadahead:
+    """
+    Reads the files of the next batches in background threads while the current batch is preprocessed.
+    Every file is read at most once per epoch.
+    """
+
+    def __init__(self, threads=2):
+        self.threads = threads
+        self.executor = None
+        self.executor_pid = None
+        self.requested = set()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # threads can not be sent to another process
+        state = self.__dict__.copy()
+        state.update(executor=None, executor_pid=None, requested=set(), lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        # the file order of a new epoch, files are read again
+        with self.lock:
+            self.requested = set()
+
+    def request(self, paths):
+        with self.lock:
+            if self.executor_pid != os.getpid():
+                # forked prefetching workers do not inherit the threads
+                self.executor = ThreadPoolExecutor(max_workers=self.threads)
+                self.executor_pid = os.getpid()
+                self.requested = set()
+
+            paths = [p for p in paths if p not in self.requested]
+            self.requested.update(paths)
+
+        for path in paths:
+            self.executor.submit(read_file, path)
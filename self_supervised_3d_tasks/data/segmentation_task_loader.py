@@ -1,12 +1,24 @@
 from pathlib import Path
 
 import numpy as np
-from scipy import ndimage
 
+from self_supervised_3d_tasks.data.compact_dtype import read_compact_dtype, decode_compact
 from self_supervised_3d_tasks.data.generator_base import DataGeneratorBase
+from self_supervised_3d_tasks.data.intensity_stats import read_intensity_stats, get_intensity_bounds, normalize_volume
+from self_supervised_3d_tasks.data.lazy_volume import LazyBatch, open_volume
+from self_supervised_3d_tasks.data.patch_sampler import (
+    sample_patch_offsets,
+    read_patch,
+    foreground_points,
+    check_patch_bounds,
+)
+from self_supervised_3d_tasks.data.shape_buckets import read_file_shapes, pad_to_shape
+from self_supervised_3d_tasks.preprocessing.augment_3d import augment_scan_and_mask
+from self_supervised_3d_tasks.preprocessing.utils.rng import sample_rngs
 
 
 class SegmentationGenerator3D(DataGeneratorBase):
+    data_generation_takes_rngs = True  # the sub-volumes are placed and the scans augmented at random
     def __init__(
             self,
             data_path,
@@ -15,15 +27,41 @@ class SegmentationGenerator3D(DataGeneratorBase):
             pre_proc_func=None,
             shuffle=False,
             augment=False,
-            label_stem = "_label"
+            label_stem = "_label",
+            use_mmap=False,
+            n_classes=None,
+            sparse_labels=False,
+            patch_shape=None,
+            patches_per_volume=1,
+            foreground_probability=0.0,
+            **kwargs
     ):
         self.augment_scans_train = augment
+        self.use_mmap = use_mmap
+        self.n_classes = n_classes
+        self.sparse_labels = sparse_labels
+
+        # with a patch shape, every scan yields patches_per_volume random sub-volumes instead of the whole scan
+        self.patch_shape = patch_shape
+        self.foreground_probability = foreground_probability
+        self.foreground = {}  # labeled voxels of every scan, found on its first use
+        if patch_shape is not None:
+            self.samples_per_file = patches_per_volume
 
         self.label_stem = label_stem
         self.label_dir = data_path + "_labels"
         self.data_dir = data_path
+        self.intensity_stats = read_intensity_stats(data_path)
+        self.intensity_bounds = get_intensity_bounds(data_path, self.intensity_stats)
+
+        # compact volumes are stored normalized already, the augmentations need them as float
+        self.storage_dtype = read_compact_dtype(data_path)
+        if not augment:
+            self.compact_dtype = self.storage_dtype
+        if patch_shape is not None and self.storage_dtype is None:
+            check_patch_bounds(data_path, self.intensity_stats)
 
-        super(SegmentationGenerator3D, self).__init__(file_list, batch_size, shuffle, pre_proc_func)
+        super(SegmentationGenerator3D, self).__init__(file_list, batch_size, shuffle, pre_proc_func, **kwargs)
 
     def load_image(self, index):
         file_name = self.input_images[index]
@@ -32,66 +70,98 @@ class SegmentationGenerator3D(DataGeneratorBase):
 
         return np.load(path), np.load(path_label)
 
-    def augment_3d(self, x, y):
-        def _distort_color(scan):
-            # adjust brightness
-            max_delta = 0.125
-            delta = np.random.uniform(-max_delta, max_delta)
-            scan += delta
-            # adjust contrast
-            lower = 0.5
-            upper = 1.5
-            contrast_factor = np.random.uniform(lower, upper)
-            scan_mean = np.mean(scan)
-            scan = (contrast_factor * (scan - scan_mean)) + scan_mean
-            return scan
-        processed_image, processed_mask = x.copy(), y.copy()
-        for i in range(3):
-            if np.random.rand() < 0.5:
-                processed_image = np.flip(processed_image, i)
-                processed_mask = np.flip(processed_mask, i)
-        # make rotation arbitrary instead of multiples of 90deg
-        if np.random.rand() < 0.5:
-            axis_choice = np.random.randint(0, 3)
-            if axis_choice == 0:
-                xy_angle = np.random.uniform(0, 360)
-                processed_image = ndimage.rotate(processed_image, xy_angle, axes=(0, 1), reshape=False, order=1)
-                processed_mask = ndimage.rotate(processed_mask, xy_angle, axes=(0, 1), reshape=False, order=0)
-            elif axis_choice == 1:
-                yz_angle = np.random.uniform(0, 360)
-                processed_image = ndimage.rotate(processed_image, yz_angle, axes=(1, 2), reshape=False, order=1)
-                processed_mask = ndimage.rotate(processed_mask, yz_angle, axes=(1, 2), reshape=False, order=0)
-            else:
-                xz_angle = np.random.uniform(0, 360)
-                processed_image = ndimage.rotate(processed_image, xz_angle, axes=(0, 2), reshape=False, order=1)
-                processed_mask = ndimage.rotate(processed_mask, xz_angle, axes=(0, 2), reshape=False, order=0)
-        if np.random.rand() < 0.7:
-            # color distortion (THIS DOESN'T CHANGE IN THE MASK)
-            processed_image = _distort_color(processed_image)
-        return processed_image, processed_mask
-
-    def data_generation(self, list_files_temp):
+    def get_intensity_stats(self, file_name):
+        if self.intensity_stats is None:
+            return None
+
+        return self.intensity_stats.get(file_name)
+
+    def get_file_paths(self, file_name):
+        if self.use_mmap or self.patch_shape is not None:
+            return []  # only the cropped regions are read
+
+        return ["{}/{}".format(self.data_dir, file_name), str(self.get_label_path(file_name))]
+
+    def get_file_shapes(self, file_list):
+        return read_file_shapes(self.data_dir, file_list)
+
+    def augment_3d(self, x, y, rng=None):
+        return augment_scan_and_mask(x, y, rng)
+
+    def get_label_path(self, file_name):
+        path_label = Path("{}/{}".format(self.label_dir, file_name))
+        return path_label.with_name(path_label.stem + self.label_stem).with_suffix(path_label.suffix)
+
+    def get_foreground(self, file_name, mask):
+        if self.foreground_probability <= 0:
+            return None
+
+        if file_name not in self.foreground:
+            self.foreground[file_name] = foreground_points(mask)
+
+        return self.foreground[file_name]
+
+    def load_patches(self, file_name, rng=None):
+        # only the sampled regions of the scan and its label map are read
+        img = open_volume("{}/{}".format(self.data_dir, file_name), self.intensity_bounds,
+                          normalize=self.storage_dtype is None)
+        mask = np.load(self.get_label_path(file_name), mmap_mode="r")
+
+        patches = []
+        for offset in sample_patch_offsets(img.shape[:3], self.patch_shape, self.samples_per_file, rng,
+                                           foreground=self.get_foreground(file_name, mask),
+                                           foreground_probability=self.foreground_probability):
+            patches.append((read_patch(img, offset, self.patch_shape), read_patch(mask, offset, self.patch_shape)))
+
+        return patches
+
+    def load_scans(self, file_name):
+        path = "{}/{}".format(self.data_dir, file_name)
+        mask = np.load(self.get_label_path(file_name))
+
+        if self.use_mmap:
+            img = open_volume(path, self.intensity_bounds, normalize=self.storage_dtype is None)
+        elif self.storage_dtype is not None:
+            img = np.load(path)
+        else:
+            img = normalize_volume(np.load(path), self.get_intensity_stats(file_name))
+
+        return [(img, mask)]
+
+    def data_generation(self, list_files_temp, rngs=None):
         data_x = []
         data_y = []
 
-        for file_name in list_files_temp:
-            path = "{}/{}".format(self.data_dir, file_name)
-            path_label = Path("{}/{}".format(self.label_dir, file_name))
-            path_label = path_label.with_name(path_label.stem + self.label_stem).with_suffix(path_label.suffix)
+        for file_name, rng in zip(list_files_temp, sample_rngs(rngs, len(list_files_temp))):
+            if self.patch_shape is not None:
+                scans = self.load_patches(file_name, rng)
+            else:
+                scans = self.load_scans(file_name)
 
-            mask = np.load(path_label)
-            img = np.load(path)
-            img = (img - img.min()) / (img.max() - img.min())
-            if self.augment_scans_train:
-                img, mask = self.augment_3d(img, mask)
-            data_x.append(img)
-            data_y.append(mask)
+            for img, mask in scans:
+                if self.augment_scans_train:
+                    if self.storage_dtype is not None:
+                        img = decode_compact(img, self.storage_dtype)
+                    img, mask = self.augment_3d(np.asarray(img), mask, rng)
+                if self.pad_shapes is not None:
+                    pad_shape = self.pad_shapes[file_name]
+                    img = pad_to_shape(np.asarray(img), pad_shape)
+                    mask = pad_to_shape(mask, pad_shape[:-1] + mask.shape[-1:])
+                data_x.append(img)
+                data_y.append(mask)
 
-        data_x = np.stack(data_x)
+        if self.use_mmap and not self.augment_scans_train and self.pad_shapes is None and self.patch_shape is None:
+            data_x = LazyBatch(data_x)
+        else:
+            data_x = np.stack(data_x)
         data_y = np.stack(data_y)
 
+        if self.sparse_labels:
+            # integer label map, the model one-hots it in the graph
+            return data_x, np.rint(data_y).astype(np.uint8)
+
         data_y = np.rint(data_y).astype(np.int)
-        n_classes = np.max(data_y) + 1
+        n_classes = self.n_classes if self.n_classes else np.max(data_y) + 1
         data_y = np.eye(n_classes)[data_y]
         data_y = np.squeeze(data_y, axis=-2)  # remove second last axis, which is still 1
 
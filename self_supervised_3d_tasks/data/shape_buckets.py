@@ -0,0 +1,89 @@
+import numpy as np
+import tensorflow as tf
+
+from self_supervised_3d_tasks.data.manifest import read_manifest, read_shape
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
+
+
+def read_file_shapes(data_path, file_list):
+    # shapes from the manifest, without one only the .npy headers are read
+    manifest = read_manifest(data_path)
+    if manifest is not None:
+        return {file_name: tuple(manifest[file_name]["shape"]) for file_name in file_list}
+
+    return {file_name: tuple(read_shape("{}/{}".format(data_path, file_name))[0]) for file_name in file_list}
+
+
+def bucket_shape(shape, bucket_size):
+    # spatial axes rounded up to a multiple of bucket_size, the channel axis is kept
+    spatial = [int(np.ceil(s / bucket_size)) * bucket_size for s in shape[:-1]]
+    return tuple(spatial) + tuple(shape[-1:])
+
+
+def uses_shape_buckets(kwargs):
+    # True if the train or validation generators of a config batch their files by shape bucket
+    return any(kwargs.get(key, {}).get("shape_bucket_size")
+               for key in ("train_data_generator_args", "val_data_generator_args"))
+
+
+def check_bucketed_model(model):
+    """
+    Batches of different buckets have different spatial dimensions, the inputs of the model have to accept them.
+    Finetuning models built with variable_shape do, the fully connected heads of the pretext tasks do not.
+    :raises ValueError: if an input fixes one of its last three axes before the channels
+    """
+    for model_input in model.inputs:
+        shape = tf.TensorShape(model_input.shape).as_list()
+        if any(dim is not None for dim in shape[-4:-1]):
+            raise ValueError("shape buckets need model inputs with variable spatial dimensions (None), "
+                             "input {} has shape {}".format(model_input.name, shape))
+
+
+def plan_buckets(buckets, batch_size, rng=None, shuffle=True):
+    """
+    Order the files so every run of batch_size files shares one bucket. The files of a bucket that do not fill
+    a run are collected at the end, sorted by bucket, and padded to the largest bucket of their run.
+    :param buckets: dict from file name to its bucket shape
+    :param batch_size: number of consecutive files padded to the same shape
+    :param shuffle: shuffle the files inside the buckets and the order of the runs
+    :return: file order and dict from file name to the shape it is padded to
+    """
+    rng = as_generator(rng)
+    by_bucket = {}
+    for file_name in sorted(buckets):
+        by_bucket.setdefault(buckets[file_name], []).append(file_name)
+
+    runs = []
+    rest = []
+    for bucket in sorted(by_bucket):
+        files = by_bucket[bucket]
+        if shuffle:
+            files = [files[int(k)] for k in rng.permutation(len(files))]
+
+        n_full = len(files) - len(files) % batch_size
+        runs += [files[i:i + batch_size] for i in range(0, n_full, batch_size)]
+        rest += files[n_full:]
+
+    if shuffle:
+        runs = [runs[int(k)] for k in rng.permutation(len(runs))]
+    runs += [rest[i:i + batch_size] for i in range(0, len(rest), batch_size)]
+
+    pad_shapes = {}
+    for run in runs:
+        shape = tuple(np.max([buckets[file_name] for file_name in run], axis=0))
+        pad_shapes.update({file_name: shape for file_name in run})
+
+    return [file_name for run in runs for file_name in run], pad_shapes
+
+
+def pad_to_shape(volume, shape):
+    """
+    Zero pad volume evenly on both sides of every axis to shape, zero is the background of normalized scans
+    and of label maps.
+    """
+    missing = np.array(shape) - np.array(volume.shape)
+    if not np.any(missing):
+        return volume
+
+    before = missing // 2
+    return np.pad(volume, list(zip(before, missing - before)), mode="constant", constant_values=0)
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+def _to_structure(batch):
+    # keras expects several inputs or outputs of a dataset element as tuple
+    x, y = batch
+    if isinstance(x, list):
+        x = tuple(x)
+    if isinstance(y, list):
+        y = tuple(y)
+
+    return x, y
+
+
+def make_tf_dataset(generator, num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                    prefetch_size=tf.data.experimental.AUTOTUNE, cache=False, map_func=None):
+    """
+    Wrap a DataGeneratorBase into a tf.data.Dataset. Batches are built by the generator, including its
+    pre_proc_func, in several threads of the tf.data runtime and are prefetched while the model trains.
+    Loading and preprocessing stay Python code inside tf.py_function and hold the GIL, the threads only overlap
+    where numpy, scipy and file reads release it. The dataset is a prefetching wrapper of the generator, files
+    are not interleaved by the tf.data runtime.
+    :param generator: the generator to wrap, its first batch gives the output types and shapes and is the first
+    batch of the first epoch
+    :param num_parallel_calls: number of batches that are built at the same time
+    :param prefetch_size: number of finished batches kept ready
+    :param cache: cache the batches of the first epoch, in memory (True) or in the given file (String)
+    :param map_func: function of the batch tensors (x, y) applied after the cache, e.g. in-graph augmentations
+    :return: dataset yielding one epoch of batches per iteration
+    """
+    example = tf.nest.map_structure(np.asarray, _to_structure(generator[0]))
+    flat_example = tf.nest.flatten(example)
+    flat_types = [tf.as_dtype(e.dtype) for e in flat_example]
+
+    # the probed batch is served as batch 0 of the first epoch, so it is not loaded twice
+    probe = [flat_example]
+    probe_lock = threading.Lock()
+
+    def epoch_indices():
+        # a new iteration is a new epoch, shuffle the files like keras does for a Sequence
+        if epoch_indices.started:
+            generator.on_epoch_end()
+            epoch_indices.started_again = True
+        epoch_indices.started = True
+
+        for index in range(len(generator)):
+            yield index
+
+    epoch_indices.started = False
+    epoch_indices.started_again = False
+
+    def load_batch(index):
+        index = int(index)
+        if index == 0 and not epoch_indices.started_again:
+            with probe_lock:
+                if len(probe) > 0:
+                    return probe.pop()
+
+        return tf.nest.flatten(tf.nest.map_structure(np.asarray, _to_structure(generator[index])))
+
+    def get_shape(e):
+        if generator.file_buckets is not None and e.ndim > 2:
+            # batches of different shape buckets differ in every axis but the channels
+            return (None,) * (e.ndim - 1) + e.shape[-1:]
+
+        return (None,) + e.shape[1:]  # the last batch can be smaller
+
+    def load_batch_tf(index):
+        flat = tf.py_function(load_batch, [index], flat_types)
+        for tensor, e in zip(flat, flat_example):
+            tensor.set_shape(get_shape(e))
+
+        return tf.nest.pack_sequence_as(example, flat)
+
+    dataset = tf.data.Dataset.from_generator(epoch_indices, tf.int64, tf.TensorShape([]))
+    dataset = dataset.map(load_batch_tf, num_parallel_calls=num_parallel_calls)
+
+    if cache:
+        dataset = dataset.cache(cache if isinstance(cache, str) else "")
+        if generator.shuffle:
+            # the files are no longer reshuffled, at least visit the cached batches in a new order
+            dataset = dataset.shuffle(len(generator), reshuffle_each_iteration=True)
+
+    if map_func is not None:
+        dataset = dataset.map(map_func, num_parallel_calls=num_parallel_calls)
+
+    return dataset.prefetch(prefetch_size)
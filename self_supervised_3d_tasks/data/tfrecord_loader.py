@@ -0,0 +1,201 @@
+import itertools
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from self_supervised_3d_tasks.data.generator_base import DataGeneratorBase
+from self_supervised_3d_tasks.data.locality_shuffle import shuffle_windows
+
+RECORD_FEATURES = {
+    "image/height": tf.io.FixedLenFeature([], tf.int64),
+    "image/width": tf.io.FixedLenFeature([], tf.int64),
+    "image/depth": tf.io.FixedLenFeature([], tf.int64, default_value=0),
+    "image/channels": tf.io.FixedLenFeature([], tf.int64),
+    "image/encoded": tf.io.VarLenFeature(tf.float32),
+    "image/mask": tf.io.VarLenFeature(tf.int64),
+}
+
+
+def parse_record(serialized):
+    features = tf.io.parse_single_example(serialized, RECORD_FEATURES)
+    return {
+        "height": features["image/height"],
+        "width": features["image/width"],
+        "depth": features["image/depth"],
+        "channels": features["image/channels"],
+        "image": features["image/encoded"].values,
+        "mask": features["image/mask"].values,
+    }
+
+
+def reconstruct_record(record):
+    """
+    Reshape the flat buffers of a parsed record. The brats writers do not store the depth of 3D scans,
+    it is derived from the buffer size then.
+    :return: image (h, w, [d,] c) and mask (h, w, [d,] 1), None if the record has no mask
+    """
+    height, width, channels = int(record["height"]), int(record["width"]), int(record["channels"])
+    image = record["image"].numpy()
+
+    depth = int(record["depth"])
+    if depth == 0:
+        depth = image.size // (height * width * channels)
+
+    shape = (height, width) if depth == 1 else (height, width, depth)
+    image = image.reshape(shape + (channels,))
+
+    mask = record["mask"].numpy()
+    if mask.size == 0:
+        return image, None
+
+    return image, mask.reshape(shape + (-1,))
+
+
+def count_records(path):
+    return sum(1 for _ in tf.data.TFRecordDataset(path))
+
+
+class ShardReader:
+    """
+    Streams the records of one shard. Reading forward continues the open stream, parsing runs ahead
+    in the tf.data runtime. The last lookback records are kept, reading an earlier record reopens the shard.
+    Reads of one shard are serialized, different shards are read at the same time.
+    """
+
+    def __init__(self, path, lookback=0):
+        self.path = path
+        self.lookback = lookback
+        self.recent = OrderedDict()
+        self.records = None
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def open(self, start):
+        dataset = tf.data.TFRecordDataset(self.path).skip(start)
+        dataset = dataset.map(parse_record, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        self.records = iter(dataset.prefetch(tf.data.experimental.AUTOTUNE))
+        self.position = start
+
+    def next_record(self):
+        record = next(self.records)
+        if self.lookback > 0:
+            self.recent[self.position] = record
+            while len(self.recent) > self.lookback:
+                self.recent.popitem(last=False)
+
+        self.position += 1
+        return record
+
+    def read(self, index):
+        with self.lock:
+            if index in self.recent:
+                return self.recent[index]
+
+            if self.records is None or index < self.position:
+                # start early enough to keep the records before it, they are read in the same window
+                self.open(max(index - self.lookback, 0))
+
+            while self.position < index:
+                self.next_record()
+
+            return self.next_record()
+
+
+class TFRecordGenerator(DataGeneratorBase):
+    """
+    Reads the sharded TFRecords written by data_util/brats_dataset_utils.py and data_util/ukb_dataset_utils.py.
+    The files of this generator are the shards, every record in them is one sample. Records are read in
+    shard order, cycle_length shards at a time are interleaved, so every shard is read sequentially.
+    With shuffle_buffer_size, records are also shuffled inside windows of that many consecutive records.
+    """
+
+    def __init__(self,
+                 data_path,
+                 file_list,
+                 batch_size=8,
+                 shuffle=True,
+                 pre_proc_func=None,
+                 records_per_shard=None,
+                 cycle_length=4,
+                 n_classes=None,
+                 sparse_labels=False,
+                 **kwargs):
+        self.path_to_data = data_path
+        self.cycle_length = cycle_length
+        self.n_classes = n_classes
+        self.sparse_labels = sparse_labels
+
+        self.shards = sorted(file_list)
+        if records_per_shard is None:
+            # one pass over every shard, set records_per_shard to skip it
+            self.shard_sizes = {s: count_records("{}/{}".format(data_path, s)) for s in self.shards}
+        else:
+            self.shard_sizes = {s: records_per_shard for s in self.shards}
+
+        self.readers = OrderedDict()
+        self.reader_lock = threading.Lock()  # guards the readers, every reader locks its own shard
+
+        records = [(s, k) for s in self.shards for k in range(self.shard_sizes[s])]
+        super(TFRecordGenerator, self).__init__(records, batch_size, shuffle, pre_proc_func, **kwargs)
+
+    def shuffle_files(self):
+        shards = list(self.shards)
+        rng = self.get_epoch_rng()
+        if rng is None:
+            random.shuffle(shards)
+        else:
+            rng.shuffle(shards)
+
+        records = []
+        for i in range(0, len(shards), self.cycle_length):
+            group = [[(s, k) for k in range(self.shard_sizes[s])] for s in shards[i:i + self.cycle_length]]
+            for interleaved in itertools.zip_longest(*group):
+                records += [r for r in interleaved if r is not None]
+
+        if self.shuffle_buffer_size:
+            # the readers keep the records of a window, so every shard is still read only once
+            records = shuffle_windows(records, self.shuffle_buffer_size, rng)
+
+        self.list_IDs = records
+
+    def get_reader(self, shard):
+        with self.reader_lock:
+            reader = self.readers.get(shard)
+            if reader is None:
+                reader = ShardReader("{}/{}".format(self.path_to_data, shard), lookback=self.shuffle_buffer_size or 0)
+                self.readers[shard] = reader
+
+                # threads still reading an evicted shard finish with their reference
+                while len(self.readers) > 2 * self.cycle_length:
+                    self.readers.popitem(last=False)
+            else:
+                self.readers.move_to_end(shard)
+
+            return reader
+
+    def data_generation(self, list_files_temp):
+        data_x = []
+        data_y = []
+
+        for shard, index in list_files_temp:
+            img, mask = reconstruct_record(self.get_reader(shard).read(index))
+
+            data_x.append(img)
+            data_y.append(mask if mask is not None else 0)
+
+        data_x = np.stack(data_x)
+        data_y = np.stack(data_y)
+
+        if data_y.ndim > 1 and self.sparse_labels:
+            # integer label map, the model one-hots it in the graph
+            data_y = np.rint(data_y).astype(np.uint8)
+        elif data_y.ndim > 1:
+            data_y = np.rint(data_y).astype(np.int)
+            n_classes = self.n_classes if self.n_classes else np.max(data_y) + 1
+            data_y = np.eye(n_classes)[data_y]
+            data_y = np.squeeze(data_y, axis=-2)  # remove second last axis, which is still 1
+
+        return data_x, data_y
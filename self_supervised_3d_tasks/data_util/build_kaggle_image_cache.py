@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from PIL import Image
+
+from self_supervised_3d_tasks.data.kaggle_image_cache import CACHE_IMAGES, CACHE_BUILT
+
+
+def decode_rows(rows, data_path, image_names, cache_path, suffix):
+    images = np.load(os.path.join(cache_path, CACHE_IMAGES), mmap_mode="r+")
+    built = np.load(os.path.join(cache_path, CACHE_BUILT), mmap_mode="r+")
+
+    for row in rows:
+        path = Path(data_path) / image_names[row]
+        image = np.array(Image.open(path.with_suffix(suffix)), dtype="uint8")
+
+        if image.shape != images.shape[1:]:
+            print("Skipping {}, it is not at the working resolution {}.".format(path, images.shape[1:]))
+            continue
+
+        images[row] = image
+        images.flush()  # the row is complete before it is marked as decoded
+        built[row] = True
+        built.flush()
+
+
+def build_kaggle_image_cache(data_path, csv_file, cache_path, suffix=".jpeg", workers=None):
+    """
+    Decode every image listed in csv_file once into a uint8 array, indexed by the row in the CSV.
+    The working resolution is the one of the first image. KaggleGenerator reads rows from the cache
+    as soon as they are decoded, so the builder can run in the background of a training job.
+    Rows that were decoded by an earlier run are skipped.
+    """
+    image_names = list(pd.read_csv(csv_file).iloc[:, 0])
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+
+    images_path = os.path.join(cache_path, CACHE_IMAGES)
+    built_path = os.path.join(cache_path, CACHE_BUILT)
+
+    if not os.path.isfile(built_path):
+        first = np.array(Image.open((Path(data_path) / image_names[0]).with_suffix(suffix)), dtype="uint8")
+        open_memmap(images_path, mode="w+", dtype=np.uint8, shape=(len(image_names), *first.shape)).flush()
+        open_memmap(built_path, mode="w+", dtype=np.bool_, shape=(len(image_names),)).flush()
+
+    built = np.load(built_path, mmap_mode="r")
+    rows = np.flatnonzero(~built)
+    print("decoding " + str(len(rows)) + " of " + str(len(image_names)) + " images.")
+
+    workers = workers or multiprocessing.cpu_count()
+    chunks = [rows[i::workers] for i in range(workers)]
+    with multiprocessing.Pool(workers) as p:
+        p.starmap(decode_rows, [(chunk, data_path, image_names, cache_path, suffix) for chunk in chunks])
+
+
+if __name__ == "__main__":
+    build_kaggle_image_cache(*sys.argv[1:4])
@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+import sys
+
+from joblib import Parallel, delayed
+
+from self_supervised_3d_tasks.data.manifest import read_manifest, write_manifest, describe_file
+
+
+def build_manifest(data_path, hash_contents=True, chunk_size=1000):
+    """
+    Describe every file in data_path in parallel and write the manifest next to the directory.
+    Files that did not change since the last build keep their entry, deleted files are dropped.
+    The manifest is written after every chunk of files, so an interrupted build continues where it stopped.
+    The loaders only use it once the build has finished.
+    """
+    previous = read_manifest(data_path, partial=True) or {}
+    file_names = sorted(os.listdir(data_path))
+    print("building manifest of " + str(len(file_names)) + " files.")
+
+    entries = {file_name: previous[file_name] for file_name in file_names if file_name in previous}
+    num_cores = multiprocessing.cpu_count()
+
+    for i in range(0, len(file_names), chunk_size):
+        chunk = file_names[i:i + chunk_size]
+        results = Parallel(n_jobs=num_cores)(
+            delayed(describe_file)(data_path, file_name, previous.get(file_name), hash_contents)
+            for file_name in chunk)
+
+        entries.update(zip(chunk, results))
+        write_manifest(data_path, entries, complete=i + chunk_size >= len(file_names))
+
+    return entries
+
+
+if __name__ == "__main__":
+    for data_path in sys.argv[1:]:
+        build_manifest(data_path)
@@ -0,0 +1,96 @@
+"""
+Assert that augment_scan_and_mask_tf in preprocessing/augment_3d_tf.py transforms scans and masks like
+augment_scan_and_mask in preprocessing/augment_3d.py. Both get the same draws, the numpy function is run
+unchanged with its own interpolation. Exits with an AssertionError if they differ.
+"""
+
+import numpy as np
+
+from self_supervised_3d_tasks.preprocessing.augment_3d import augment_scan_and_mask, ROTATION_AXES
+from self_supervised_3d_tasks.preprocessing.augment_3d_tf import transform_scan_and_mask_tf
+
+SCAN_TOLERANCE = 1e-4
+
+
+class ReplayRandom:
+    """
+    Random generator returning the given values in order, to run augment_scan_and_mask with known draws.
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def __next(self):
+        return self.values.pop(0)
+
+    def random(self, size=None):
+        return self.__next()
+
+    def integers(self, low, high=None, size=None):
+        return self.__next()
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return self.__next()
+
+
+def draw_parameters(rs):
+    # the draws of augment_scan_and_mask, forced to cover every plane and both branches of every choice
+    flips = rs.rand(3) < 0.5
+    rotate = rs.rand() < 0.75
+    plane = int(rs.randint(0, 3))
+    angle = float(rs.uniform(0, 360))
+    color = rs.rand() < 0.7
+    delta, contrast_factor = float(rs.uniform(-0.125, 0.125)), float(rs.uniform(0.5, 1.5))
+
+    values = [0.0 if f else 1.0 for f in flips] + [0.0 if rotate else 1.0]
+    if rotate:
+        values += [plane, angle]
+    values += [0.0 if color else 1.0]
+    if color:
+        values += [delta, contrast_factor]
+
+    plane_angles = np.zeros(3)
+    if rotate:
+        plane_angles[plane] = angle
+
+    return values, (flips, plane_angles, color, delta, contrast_factor)
+
+
+def check_parity(size=(24, 20, 16), channels=2, n_classes=3, n_draws=24, seed=0):
+    """
+    :return: largest absolute difference of the scans, the masks have to be equal
+    """
+    rs = np.random.RandomState(seed)
+    largest = 0.0
+
+    for _ in range(n_draws):
+        scan = rs.rand(*size, channels).astype(np.float32)
+        mask = rs.randint(0, n_classes, (*size, 1))
+        values, (flips, plane_angles, color, delta, contrast_factor) = draw_parameters(rs)
+
+        expected_scan, expected_mask = augment_scan_and_mask(scan.copy(), mask.copy(), ReplayRandom(values))
+
+        def transform(masks):
+            return transform_scan_and_mask_tf(scan[np.newaxis], masks, flips[np.newaxis],
+                                              plane_angles[np.newaxis].astype(np.float32), np.array([color]),
+                                              np.array([delta], np.float32), np.array([contrast_factor], np.float32))
+
+        result_scan, result_mask = transform(mask[np.newaxis].astype(np.float32))
+        difference = float(np.max(np.abs(np.asarray(result_scan)[0] - expected_scan)))
+        largest = max(largest, difference)
+
+        description = "flips {}, angles {}, color {}".format(list(flips), list(plane_angles), color)
+        assert difference < SCAN_TOLERANCE, "scans differ by {} for {}".format(difference, description)
+        assert np.array_equal(np.asarray(result_mask)[0], expected_mask), "masks differ for " + description
+
+        # the generators one-hot encode the masks before a tf.data map, background is the first class
+        one_hot = np.eye(n_classes, dtype=np.float32)[mask[..., 0]]
+        _, result_one_hot = transform(one_hot[np.newaxis])
+        assert np.array_equal(np.asarray(result_one_hot)[0], np.eye(n_classes)[expected_mask[..., 0]]), \
+            "one-hot masks differ for " + description
+
+    return largest
+
+
+if __name__ == "__main__":
+    print("planes {}: scans differ by at most {}, masks are equal".format(ROTATION_AXES, check_parity()))
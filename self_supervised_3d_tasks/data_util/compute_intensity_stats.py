@@ -0,0 +1,62 @@
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from self_supervised_3d_tasks.data.intensity_stats import get_stats_path
+
+
+def compute_volume_stats(path, percentiles=(0.5, 99.5)):
+    """
+    Statistics of one .npy volume. The foreground bounding box covers every voxel above the volume minimum,
+    which is the value the converters assign to the background.
+    :return: dict with min, max, mean, std, the given percentiles and the bounding box as [start, end) per axis
+    """
+    img = np.load(path)
+    v_min = img.min()
+
+    foreground = img > v_min
+    if img.ndim == 4:
+        foreground = foreground.any(axis=-1)  # channels last
+
+    bbox = []
+    for axis in range(foreground.ndim):
+        other_axes = tuple(a for a in range(foreground.ndim) if a != axis)
+        indices = np.flatnonzero(foreground.any(axis=other_axes))
+        bbox.append([int(indices[0]), int(indices[-1]) + 1] if len(indices) > 0 else [0, 0])
+
+    return {
+        "min": float(v_min),
+        "max": float(img.max()),
+        "mean": float(img.mean(dtype=np.float64)),
+        "std": float(img.std(dtype=np.float64)),
+        "percentiles": [float(p) for p in np.percentile(img, percentiles)],
+        "bbox": bbox,
+    }
+
+
+def write_intensity_stats(data_path, percentiles=(0.5, 99.5)):
+    """
+    One parallel pass over all files in data_path, the result is written next to the directory
+    and picked up by the 3D loaders. Run it again whenever the data changes.
+    """
+    file_names = sorted(os.listdir(data_path))
+    print("computing intensity statistics of " + str(len(file_names)) + " files.")
+
+    num_cores = multiprocessing.cpu_count()
+    results = Parallel(n_jobs=num_cores)(
+        delayed(compute_volume_stats)(os.path.join(data_path, file_name), percentiles) for file_name in file_names)
+
+    index = {"percentiles": list(percentiles), "files": dict(zip(file_names, results))}
+    with open(get_stats_path(data_path), "w") as f:
+        json.dump(index, f)
+
+    return index
+
+
+if __name__ == "__main__":
+    for data_path in sys.argv[1:]:
+        write_intensity_stats(data_path)
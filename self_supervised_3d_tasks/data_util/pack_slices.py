@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from self_supervised_3d_tasks.data.packed_slices import PACKED_INDEX, PACKED_IMAGES, PACKED_LABELS
+
+
+def pack_slice_directory(data_path, result_path):
+    """
+    Convert a directory with one .npy file per 2D slice (and its "_labels" directory, if there is one)
+    into a packed slice store: one image array, one label array and an index from file name to row.
+    The result can be used as data_dir for Numpy2DLoader.
+    """
+    label_dir = data_path + "_labels"
+    has_labels = Path(label_dir).exists()
+
+    file_names = sorted(os.listdir(data_path))
+    assert len(file_names) > 0, "received no files"
+
+    first = np.load("{}/{}".format(data_path, file_names[0]))
+    Path(result_path).mkdir(parents=True, exist_ok=True)
+    images = open_memmap(os.path.join(result_path, PACKED_IMAGES), mode="w+", dtype=first.dtype,
+                         shape=(len(file_names), *first.shape))
+
+    labels = None
+    if has_labels:
+        first_label = np.load("{}/{}".format(label_dir, file_names[0]))
+        labels = open_memmap(os.path.join(result_path, PACKED_LABELS), mode="w+", dtype=first_label.dtype,
+                             shape=(len(file_names), *first_label.shape))
+
+    for i, file_name in enumerate(file_names):
+        images[i] = np.load("{}/{}".format(data_path, file_name))
+        if has_labels:
+            labels[i] = np.load("{}/{}".format(label_dir, file_name))
+
+        if i % 1000 == 0:
+            perc = (float(i) * 100.0) / len(file_names)
+            print(f"{perc:.2f} % done")
+
+    images.flush()
+    if has_labels:
+        labels.flush()
+
+    index = {
+        "files": file_names,
+        "offsets": list(range(len(file_names))),
+        "has_labels": has_labels,
+    }
+    with open(os.path.join(result_path, PACKED_INDEX), "w") as f:
+        json.dump(index, f)
+
+
+if __name__ == "__main__":
+    pack_slice_directory(sys.argv[1], sys.argv[2])
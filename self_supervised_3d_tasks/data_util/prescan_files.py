@@ -0,0 +1,49 @@
+import multiprocessing
+import os
+import sys
+
+from joblib import Parallel, delayed
+
+from self_supervised_3d_tasks.data.manifest import get_label_dir, find_label
+from self_supervised_3d_tasks.data.quarantine import validate_file, write_quarantine
+
+
+def prescan_file(data_path, file_name, expected_shape=None):
+    # the file and its label file, if there is one
+    error = validate_file(os.path.join(data_path, file_name), expected_shape)
+    if error is not None:
+        return error
+
+    label_path = find_label(get_label_dir(data_path), file_name)
+    if label_path is not None:
+        error = validate_file(str(label_path))
+        if error is not None:
+            return "label " + error
+
+    return None
+
+
+def prescan_files(data_path, expected_shape=None):
+    """
+    Read every file in data_path in parallel and write the ones that fail into the quarantine list
+    next to the directory. The generators leave quarantined files out. Run it again whenever the data changes.
+    :param expected_shape: shape every file must have, None accepts any shape
+    :return: dict from quarantined file name to its error
+    """
+    file_names = sorted(os.listdir(data_path))
+    print("scanning " + str(len(file_names)) + " files.")
+
+    num_cores = multiprocessing.cpu_count()
+    results = Parallel(n_jobs=num_cores)(
+        delayed(prescan_file)(data_path, file_name, expected_shape) for file_name in file_names)
+
+    errors = {file_name: error for file_name, error in zip(file_names, results) if error is not None}
+    write_quarantine(data_path, errors)
+    print("quarantined " + str(len(errors)) + " files.")
+
+    return errors
+
+
+if __name__ == "__main__":
+    for data_path in sys.argv[1:]:
+        prescan_files(data_path)
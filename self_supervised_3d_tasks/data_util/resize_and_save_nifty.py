@@ -10,6 +10,7 @@ import numpy as np
 import skimage.transform as skTrans
 from joblib import Parallel, delayed
 
+from self_supervised_3d_tasks.data.compact_dtype import save_volume, write_compact_metadata
 from self_supervised_3d_tasks.data_util.nifti_utils import read_scan_find_bbox
 
 def split_slices_to_single_files():
@@ -110,13 +111,17 @@ def data_generation_pancreas_2D_slices():
             traceback.print_tb(e.__traceback__)
             continue
 
-def data_generation_pancreas():
+def data_generation_pancreas(storage_dtype=None):
+    """
+    :param storage_dtype: None keeps the float volumes, 'uint8' or 'float16' stores them normalized and compact
+    """
     result_path = "/mnt/mpws2019cl1/Task07_Pancreas/images_resized_128_labeled"
     path_to_data = "/mnt/mpws2019cl1/Task07_Pancreas/imagesTr"
     path_to_labels = "/mnt/mpws2019cl1/Task07_Pancreas/labelsTr"
 
     dim = (128, 128, 128)
     list_files_temp = os.listdir(path_to_data)
+    metadata = {}
 
     for i, file_name in enumerate(list_files_temp):
         path_to_image = "{}/{}".format(path_to_data, file_name)
@@ -140,7 +145,7 @@ def data_generation_pancreas():
 
             file_name = file_name[:file_name.index('.')] + ".npy"
             label_file_name = file_name[:file_name.index('.')] + "_label.npy"
-            np.save("{}/{}".format(result_path, file_name), result)
+            metadata[file_name] = save_volume("{}/{}".format(result_path, file_name), result, storage_dtype)
             np.save("{}/{}".format(result_path, label_file_name), label_result)
 
             perc = (float(i) * 100.0) / len(list_files_temp)
@@ -151,6 +156,9 @@ def data_generation_pancreas():
             traceback.print_tb(e.__traceback__)
             continue
 
+    if storage_dtype is not None:
+        write_compact_metadata(result_path, storage_dtype, metadata)
+
 def data_conversion_ukb():
     source_path = "/mnt/30T/ukbiobank/original/imaging/brain_mri/"
     destination_path = "/mnt/30T/ukbiobank/derived/imaging/brain_mri/"
@@ -197,9 +205,10 @@ def data_conversion_ukb():
         if count % 100 == 0:
             print("Processed " + str(count) + " scans so far.")
 
-def data_conversion_brats(split='train'):
+def data_conversion_brats(split='train', storage_dtype=None):
     """
     :param split: can be 'train' or 'val'
+    :param storage_dtype: None keeps the float volumes, 'uint8' or 'float16' stores them normalized and compact
     """
     new_resolution = (128, 128, 128)
     train_path = '/mnt/30T/brats/train/**/'
@@ -222,16 +231,20 @@ def data_conversion_brats(split='train'):
     results = Parallel(n_jobs=num_cores)(
         delayed(read_mm_slice_brats)(flair_files, i, seg_files, t1_files, t1ce_files, t2_files, new_resolution) for i in
         range(len(t1_files)))
+    metadata = {}
     for i, item in enumerate(results):
         file_name = os.path.basename(t1ce_files[i]).replace('_t1ce.nii.gz', '')
         scan_file_name = file_name + ".npy"
         mask_file_name = file_name + "_label.npy"
-        np.save("{}/{}".format(result_path, scan_file_name), item[0])
+        metadata[scan_file_name] = save_volume("{}/{}".format(result_path, scan_file_name), item[0], storage_dtype)
         np.save("{}/{}".format(result_path, mask_file_name), item[1])
 
         perc = (float(i) * 100.0) / len(results)
         print(f"{perc:.2f} % done")
 
+    if storage_dtype is not None:
+        write_compact_metadata(result_path, storage_dtype, metadata)
+
 def read_mm_slice_brats(flair_files, i, seg_files, t1_files, t1ce_files, t2_files, new_resolution):
     t1ce_image, nbbox = read_scan_find_bbox(nib.load(t1ce_files[i]).get_fdata(), normalize=False)
     t1ce_image = skTrans.resize(t1ce_image, new_resolution, order=1, preserve_range=True)
@@ -251,26 +264,34 @@ def read_mm_slice_brats(flair_files, i, seg_files, t1_files, t1ce_files, t2_file
 def read_scan(sbbox, nif_file):
     return nif_file.get_fdata()[sbbox[0]:sbbox[1], sbbox[2]:sbbox[3], sbbox[4]:sbbox[5]]
 
-def preprocess_ukb_3D_multimodal():
+def preprocess_ukb_3D_multimodal(storage_dtype=None):
+    """
+    :param storage_dtype: None keeps the float volumes, 'uint8' or 'float16' stores them normalized and compact
+    """
     base_path = "/mnt/30T/ukbiobank/derived/imaging/brain_mri/"
     result_path = "/mnt/30T/ukbiobank/derived/imaging/brain_mri/images_resized_128"
     t1_files = np.array(sorted(glob.glob(base_path + "/T1/**/*.npy", recursive=True)))
     t2_flair_files = np.array(sorted(glob.glob(base_path + "/T2_FLAIR/**/*.npy", recursive=True)))
 
     num_cores = multiprocessing.cpu_count()
-    Parallel(n_jobs=num_cores)(
-        delayed(read_ukb_scan_multimodal)(t1_files, t2_flair_files, i, result_path) for i in
+    value_ranges = Parallel(n_jobs=num_cores)(
+        delayed(read_ukb_scan_multimodal)(t1_files, t2_flair_files, i, result_path, storage_dtype) for i in
         range(len(t2_flair_files)))
     print("done preprocessing images")
 
-def read_ukb_scan_multimodal(t1_files, t2_flair_files, i, result_path):
+    if storage_dtype is not None:
+        metadata = {os.path.basename(f): value_range for f, value_range in zip(t1_files, value_ranges)}
+        write_compact_metadata(result_path, storage_dtype, metadata)
+
+def read_ukb_scan_multimodal(t1_files, t2_flair_files, i, result_path, storage_dtype=None):
     t1_scan, sbbox = read_scan_find_bbox(np.load(t1_files[i]))
     t2_flair_scan = np.load(t2_flair_files[i])[sbbox[0]:sbbox[1], sbbox[2]:sbbox[3], sbbox[4]:sbbox[5]]
     stacked_array = np.stack([t1_scan, t2_flair_scan], axis=-1)
     scan_file_name = os.path.basename(t1_files[i])
-    np.save("{}/{}".format(result_path, scan_file_name), stacked_array)
+    value_range = save_volume("{}/{}".format(result_path, scan_file_name), stacked_array, storage_dtype)
     perc = (float(i) * 100.0) / len(t2_flair_files)
     print(f"{perc:.2f} % done")
+    return value_range
 
 
 if __name__ == "__main__":
@@ -17,8 +17,12 @@ import self_supervised_3d_tasks.utils.metrics as metrics
 from self_supervised_3d_tasks.utils.callbacks import TerminateOnNaN, NaNLossError, LogCSVWithStart
 from self_supervised_3d_tasks.utils.metrics import weighted_sum_loss, jaccard_distance, \
     weighted_categorical_crossentropy, weighted_dice_coefficient, weighted_dice_coefficient_loss, \
-    weighted_dice_coefficient_per_class
+    weighted_dice_coefficient_per_class, sparse_weighted_dice_coefficient_loss, \
+    sparse_weighted_categorical_crossentropy, brats_wt_metric, brats_tc_metric, brats_et_metric
+from self_supervised_3d_tasks.utils.metrics import sparse_labels as sparse_labels_wrapper
 from self_supervised_3d_tasks.test_data_backend import CvDataKaggle, StandardDataLoader
+from self_supervised_3d_tasks.data.shape_buckets import check_bucketed_model, uses_shape_buckets
+from self_supervised_3d_tasks.preprocessing.utils.parallel import set_preprocessing_threads
 from self_supervised_3d_tasks.train import (
     keras_algorithm_list,
 )
@@ -29,6 +33,13 @@ from self_supervised_3d_tasks.utils.model_utils import (
 from self_supervised_3d_tasks.utils.model_utils import init
 
 
+# keras losses and metrics with a variant for integer labels
+SPARSE_KERAS_NAMES = {
+    "categorical_crossentropy": "sparse_categorical_crossentropy",
+    "categorical_accuracy": "sparse_categorical_accuracy",
+}
+
+
 def get_score(score_name):
     if score_name == "qw_kappa":
         return metrics.score_kappa
@@ -60,7 +71,7 @@ def get_score(score_name):
         raise ValueError(f"score {score_name} not found")
 
 
-def make_custom_metrics(metrics):
+def make_custom_metrics(metrics, sparse_labels=False):
     metrics = list(metrics)
 
     if "weighted_dice_coefficient" in metrics:
@@ -68,9 +79,9 @@ def make_custom_metrics(metrics):
         metrics.append(weighted_dice_coefficient)
     if "brats_metrics" in metrics:
         metrics.remove("brats_metrics")
-        metrics.append(metrics.brats_wt_metric)
-        metrics.append(metrics.brats_tc_metric)
-        metrics.append(metrics.brats_et_metric)
+        metrics.append(brats_wt_metric)
+        metrics.append(brats_tc_metric)
+        metrics.append(brats_et_metric)
     if "weighted_dice_coefficient_per_class_pancreas" in metrics:
         metrics.remove("weighted_dice_coefficient_per_class_pancreas")
 
@@ -85,9 +96,19 @@ def make_custom_metrics(metrics):
         metrics.append(dice_class_1)
         metrics.append(dice_class_2)
 
+    if sparse_labels:
+        # loaders emit integer label maps, the custom metrics expect one-hot labels
+        metrics = [SPARSE_KERAS_NAMES.get(m, m) if isinstance(m, str) else sparse_labels_wrapper(m) for m in metrics]
+
     return metrics
 
-def make_custom_loss(loss):
+def make_custom_loss(loss, sparse_labels=False):
+    if sparse_labels:
+        if loss == "weighted_dice_loss":
+            return sparse_weighted_dice_coefficient_loss
+        elif loss == "weighted_categorical_crossentropy":
+            return sparse_weighted_categorical_crossentropy()
+
     if loss == "weighted_sum_loss":
         loss = weighted_sum_loss()
     elif loss == "jaccard_distance":
@@ -97,6 +118,9 @@ def make_custom_loss(loss):
     elif loss == "weighted_categorical_crossentropy":
         loss = weighted_categorical_crossentropy()
 
+    if sparse_labels:
+        loss = SPARSE_KERAS_NAMES.get(loss, loss) if isinstance(loss, str) else sparse_labels_wrapper(loss)
+
     return loss
 
 def get_optimizer(clipnorm, clipvalue, lr):
@@ -119,13 +143,16 @@ def run_single_test(algorithm_def, gen_train, gen_val, load_weights, freeze_weig
     print(metrics)
     print(loss)
 
-    metrics = make_custom_metrics(metrics)
-    loss = make_custom_loss(loss)
+    sparse_labels = kwargs.get("sparse_labels", False)
+    metrics = make_custom_metrics(metrics, sparse_labels)
+    loss = make_custom_loss(loss, sparse_labels)
 
+    # batches of different shape buckets need a model with variable spatial dimensions
+    variable_shape = uses_shape_buckets(kwargs)
     if load_weights:
-        enc_model = algorithm_def.get_finetuning_model(model_checkpoint)
+        enc_model = algorithm_def.get_finetuning_model(model_checkpoint, variable_shape=variable_shape)
     else:
-        enc_model = algorithm_def.get_finetuning_model()
+        enc_model = algorithm_def.get_finetuning_model(variable_shape=variable_shape)
 
     pred_model = apply_prediction_model(input_shape=enc_model.outputs[0].shape[1:], algorithm_instance=algorithm_def,
                                         **kwargs)
@@ -134,6 +161,9 @@ def run_single_test(algorithm_def, gen_train, gen_val, load_weights, freeze_weig
     model = Model(inputs=enc_model.inputs[0], outputs=outputs)
     print_flat_summary(model)
 
+    if variable_shape:
+        check_bucketed_model(model)
+
     if epochs > 0:
         callbacks = [TerminateOnNaN()]
 
@@ -255,8 +285,10 @@ def run_complex_test(
         clipnorm=None,
         clipvalue=None,
         do_cross_val=False,
+        preprocessing_threads=1,
         **kwargs,
 ):
+    set_preprocessing_threads(preprocessing_threads)
     model_checkpoint = expanduser(model_checkpoint)
     if os.path.isdir(model_checkpoint):
         weight_files = list(Path(model_checkpoint).glob("weights-improvement*.hdf5"))
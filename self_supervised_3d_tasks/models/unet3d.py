@@ -119,7 +119,7 @@ def upconv_model_3d(
         filters //= 2  # decreasing number of filters with each layer
         dropout -= dropout_change_per_layer
         x = upsample(filters, (2, 2, 2), strides=(2, 2, 2), padding="same")(x)
-        c_in = Input((int(x) for x in conv.shape[1:]))
+        c_in = Input(tuple(conv.shape[1:]))  # spatial axes can be None
         inputs.append(c_in)
         x = concatenate([x, c_in])
         x = conv3d_block(
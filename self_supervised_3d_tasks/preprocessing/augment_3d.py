@@ -0,0 +1,159 @@
+import numpy as np
+from scipy import special
+
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
+
+# planes of the arbitrary rotation, in the order they are drawn
+ROTATION_AXES = ((0, 1), (1, 2), (0, 2))
+
+
+def flip_rotation_affine(shape, flips=(), axes=None, angle=0.0):
+    """
+    Compose flips followed by a rotation about the volume center into one pull-back affine,
+    matching np.flip and ndimage.rotate(reshape=False).
+    :param shape: spatial shape of the volume
+    :param flips: axes to flip
+    :param axes: plane of the rotation, None for no rotation
+    :param angle: rotation angle in degrees
+    :return: matrix and offset mapping output to input coordinates
+    """
+    ndim = len(shape)
+    shape = np.asarray(shape, dtype=np.float64)
+
+    rotation = np.eye(ndim)
+    rotation_offset = np.zeros(ndim)
+
+    if axes is not None:
+        axes = sorted(axes)
+        c, s = special.cosdg(angle), special.sindg(angle)
+        plane = np.array([[c, s], [-s, c]])
+        center = (shape[axes] - 1) / 2
+
+        rotation[np.ix_(axes, axes)] = plane
+        rotation_offset[axes] = center - plane @ center
+
+    flip = np.ones(ndim)
+    flip_offset = np.zeros(ndim)
+    for i in flips:
+        flip[i] = -1
+        flip_offset[i] = shape[i] - 1
+
+    # output -> rotated -> flipped, the flip is applied to the input first
+    matrix = flip[:, np.newaxis] * rotation
+    offset = flip * rotation_offset + flip_offset
+
+    return matrix, offset
+
+
+class PlaneSampling:
+    """
+    Sample positions of an affine that only mixes the two axes of one plane, the other axes are at most flipped.
+    The positions are computed once for the plane and shared by every line through it, by all channels and by
+    the scan and its mask. Sampling outside the volume gives 0, like ndimage.affine_transform(mode="constant").
+    """
+
+    def __init__(self, shape, matrix, offset, axes):
+        self.axes = tuple(sorted(axes))
+        self.plane_shape = tuple(shape[a] for a in self.axes)
+        self.flips = [i for i in range(len(shape)) if i not in self.axes and matrix[i, i] < 0]
+
+        n_a, n_b = self.plane_shape
+        grid = np.indices(self.plane_shape).reshape(2, -1).astype(np.float64)
+        p, q = matrix[np.ix_(self.axes, self.axes)] @ grid + offset[list(self.axes)][:, np.newaxis]
+
+        eps = 1e-6
+        self.valid = (p > -eps) & (p < n_a - 1 + eps) & (q > -eps) & (q < n_b - 1 + eps)
+
+        # nearest neighbour
+        p_n = np.clip(np.floor(p + 0.5), 0, n_a - 1).astype(np.intp)
+        q_n = np.clip(np.floor(q + 0.5), 0, n_b - 1).astype(np.intp)
+        self.nearest = p_n * n_b + q_n
+
+        # linear, the lower corner is kept inside so both neighbours exist
+        p_0 = np.clip(np.floor(p), 0, max(n_a - 2, 0))
+        q_0 = np.clip(np.floor(q), 0, max(n_b - 2, 0))
+        f_p, f_q = np.clip(p - p_0, 0, 1), np.clip(q - q_0, 0, 1)
+        p_0, q_0 = p_0.astype(np.intp), q_0.astype(np.intp)
+        p_1, q_1 = np.minimum(p_0 + 1, n_a - 1), np.minimum(q_0 + 1, n_b - 1)
+
+        self.corners = [p_0 * n_b + q_0, p_0 * n_b + q_1, p_1 * n_b + q_0, p_1 * n_b + q_1]
+        self.weights = [(1 - f_p) * (1 - f_q), (1 - f_p) * f_q, f_p * (1 - f_q), f_p * f_q]
+        self.weights = [w * self.valid for w in self.weights]
+
+    def __to_rows(self, volume):
+        moved = np.moveaxis(volume, self.axes, (0, 1))
+        return moved.shape, moved.reshape(self.plane_shape[0] * self.plane_shape[1], -1)
+
+    def __from_rows(self, rows, moved_shape):
+        volume = np.moveaxis(rows.reshape(moved_shape), (0, 1), self.axes)
+        for i in self.flips:
+            volume = np.flip(volume, i)
+
+        return volume
+
+    def nearest_sample(self, volume):
+        moved_shape, rows = self.__to_rows(volume)
+        result = rows[self.nearest]
+        result[~self.valid] = 0
+
+        return self.__from_rows(result, moved_shape)
+
+    def linear_sample(self, volume):
+        moved_shape, rows = self.__to_rows(volume)
+        dtype = rows.dtype if np.issubdtype(rows.dtype, np.floating) else np.float32
+
+        result = np.zeros(rows.shape, dtype=dtype)
+        for corner, weight in zip(self.corners, self.weights):
+            result += rows[corner] * weight.astype(dtype)[:, np.newaxis]
+
+        return self.__from_rows(result, moved_shape)
+
+
+def distort_color_(scan, delta, contrast_factor):
+    # adjust brightness and contrast in place
+    scan += delta
+    scan_mean = np.mean(scan)
+    scan -= scan_mean
+    scan *= contrast_factor
+    scan += scan_mean
+    return scan
+
+
+def augment_scan_and_mask(x, y, rng=None):
+    """
+    Random flips, an arbitrary rotation in one of the three planes and a color distortion of the scan.
+    Flips and rotation are composed into one affine, scan and mask are resampled once from the same positions.
+    :param rng: random generator of the scan, None to use the global random state
+    """
+    rng = as_generator(rng)
+    flips = [i for i in range(3) if rng.random() < 0.5]
+
+    axes, angle = None, 0.0
+    # make rotation arbitrary instead of multiples of 90deg
+    if rng.random() < 0.5:
+        axes = ROTATION_AXES[int(rng.integers(0, 3))]
+        angle = rng.uniform(0, 360)
+
+    if axes is None:
+        # flipping needs no interpolation, views are enough
+        processed_image, processed_mask = x, y
+        for i in flips:
+            processed_image = np.flip(processed_image, i)
+            processed_mask = np.flip(processed_mask, i)
+        processed_image = np.array(processed_image)
+    else:
+        matrix, offset = flip_rotation_affine(x.shape[:3], flips, axes, angle)
+        sampling = PlaneSampling(x.shape[:3], matrix, offset, axes)
+        processed_image = sampling.linear_sample(x)
+        processed_mask = sampling.nearest_sample(y)
+
+    if rng.random() < 0.7:
+        # color distortion (THIS DOESN'T CHANGE IN THE MASK)
+        if not np.issubdtype(processed_image.dtype, np.floating):
+            processed_image = processed_image.astype(np.float32)
+        max_delta = 0.125
+        delta = rng.uniform(-max_delta, max_delta)
+        contrast_factor = rng.uniform(0.5, 1.5)
+        processed_image = distort_color_(processed_image, delta, contrast_factor)
+
+    return processed_image, processed_mask
@@ -0,0 +1,157 @@
+"""
+TensorFlow version of the segmentation augmentation in preprocessing/augment_3d.py. It works on batches
+(batch, x, y, z, channels) with one random draw per sample, so it can run in a tf.data map or inside a model
+and use the intra-op thread pool of TensorFlow. Resampling is linear for scans and nearest for masks, samples
+outside the volume are 0 like in augment_scan_and_mask. data_util/check_augment_3d_tf.py asserts the parity.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+# planes of the rotations, in the order augment_exemplar_3d and augment_3d use them
+ROTATION_AXES = ((0, 1), (1, 2), (0, 2))
+
+
+def _per_sample(values, rank):
+    # reshape one value per sample to broadcast against a batch of the given rank
+    return tf.reshape(values, [-1] + [1] * (rank - 1))
+
+
+def flip_3d(volumes, flips):
+    """
+    :param flips: bool (batch, 3), which of the spatial axes to flip for every sample
+    """
+    for i in range(3):
+        volumes = tf.where(_per_sample(flips[:, i], 5), tf.reverse(volumes, [i + 1]), volumes)
+
+    return volumes
+
+
+def _inside(coords, size):
+    eps = 1e-6
+    return tf.logical_and(coords > -eps, coords < tf.cast(size - 1, coords.dtype) + eps)
+
+
+def rotate_3d(volumes, angles, axes, nearest=False, fill=None):
+    """
+    Same as ndimage.rotate(reshape=False, order=1), or order=0 with nearest, for every sample.
+    An angle of 0 returns the volume unchanged.
+    :param angles: float (batch,), rotation angles in degrees
+    :param axes: spatial axes of the rotation plane
+    :param fill: channel values of voxels rotated in from outside the volume with nearest, 0 by default
+    """
+    a, b = sorted(axes)
+    other = [i for i in range(3) if i not in (a, b)][0]
+    perm = [0, a + 1, b + 1, other + 1, 4]
+    inverse_perm = list(np.argsort(perm))
+
+    moved = tf.transpose(volumes, perm)
+    shape = tf.shape(moved)
+    n_a, n_b = shape[1], shape[2]
+    rows = tf.reshape(moved, [shape[0], n_a * n_b, -1])
+
+    # pull-back positions in the plane, rotated about its center
+    angles = tf.cast(angles, tf.float64) * (np.pi / 180.0)
+    c, s = _per_sample(tf.cos(angles), 2), _per_sample(tf.sin(angles), 2)
+    grid_p, grid_q = tf.meshgrid(tf.range(n_a), tf.range(n_b), indexing="ij")
+    grid_p = tf.reshape(tf.cast(grid_p, tf.float64), [1, -1])
+    grid_q = tf.reshape(tf.cast(grid_q, tf.float64), [1, -1])
+    center_p = tf.cast(n_a - 1, tf.float64) / 2
+    center_q = tf.cast(n_b - 1, tf.float64) / 2
+    p = c * (grid_p - center_p) + s * (grid_q - center_q) + center_p
+    q = -s * (grid_p - center_p) + c * (grid_q - center_q) + center_q
+
+    valid = tf.logical_and(_inside(p, n_a), _inside(q, n_b))[..., tf.newaxis]
+
+    if nearest:
+        p_n = tf.clip_by_value(tf.floor(p + 0.5), 0, tf.cast(n_a - 1, tf.float64))
+        q_n = tf.clip_by_value(tf.floor(q + 0.5), 0, tf.cast(n_b - 1, tf.float64))
+        index = tf.cast(p_n, tf.int32) * n_b + tf.cast(q_n, tf.int32)
+        result = tf.gather(rows, index, batch_dims=1)
+        if fill is None:
+            outside = tf.zeros_like(result)
+        else:
+            # the rows hold the channels of every voxel along the third axis one after another
+            outside = tf.broadcast_to(tf.tile(tf.cast(fill, result.dtype), [shape[3]]), tf.shape(result))
+        result = tf.where(valid, result, outside)
+    else:
+        p_0 = tf.clip_by_value(tf.floor(p), 0, tf.cast(tf.maximum(n_a - 2, 0), tf.float64))
+        q_0 = tf.clip_by_value(tf.floor(q), 0, tf.cast(tf.maximum(n_b - 2, 0), tf.float64))
+        f_p = tf.clip_by_value(p - p_0, 0, 1)
+        f_q = tf.clip_by_value(q - q_0, 0, 1)
+        p_0, q_0 = tf.cast(p_0, tf.int32), tf.cast(q_0, tf.int32)
+        p_1, q_1 = tf.minimum(p_0 + 1, n_a - 1), tf.minimum(q_0 + 1, n_b - 1)
+
+        corners = [p_0 * n_b + q_0, p_0 * n_b + q_1, p_1 * n_b + q_0, p_1 * n_b + q_1]
+        weights = [(1 - f_p) * (1 - f_q), (1 - f_p) * f_q, f_p * (1 - f_q), f_p * f_q]
+
+        result = tf.zeros_like(rows)
+        for corner, weight in zip(corners, weights):
+            weight = tf.cast(tf.where(valid[..., 0], weight, tf.zeros_like(weight)), rows.dtype)
+            result += tf.gather(rows, corner, batch_dims=1) * weight[..., tf.newaxis]
+
+    return tf.transpose(tf.reshape(result, shape), inverse_perm)
+
+
+def distort_color_3d(volumes, delta, contrast_factor):
+    """
+    Brightness and contrast of every sample, the contrast is scaled about the mean of the sample.
+    :param delta: float (batch,), brightness offset
+    :param contrast_factor: float (batch,)
+    """
+    volumes = volumes + tf.cast(_per_sample(delta, 5), volumes.dtype)
+    mean = tf.reduce_mean(volumes, axis=[1, 2, 3, 4], keepdims=True)
+    return tf.cast(_per_sample(contrast_factor, 5), volumes.dtype) * (volumes - mean) + mean
+
+
+def get_mask_background(masks):
+    # label of voxels outside the volume, the first class of one-hot masks, 0 for integer label maps
+    n_classes = masks.shape[-1]
+    if n_classes is None:
+        raise ValueError("the number of label channels has to be known")
+    if n_classes == 1:
+        return None
+
+    return tf.one_hot(0, n_classes, dtype=masks.dtype)
+
+
+def transform_scan_and_mask_tf(volumes, masks, flips, plane_angles, apply_color, delta, contrast_factor):
+    """
+    The transformation of augment_scan_and_mask with given draws.
+    :param flips: bool (batch, 3), which of the spatial axes to flip for every sample
+    :param plane_angles: float (batch, 3), rotation angle of every sample in each plane of ROTATION_AXES,
+    augment_scan_and_mask rotates in at most one plane
+    :param apply_color: bool (batch,), which samples are color distorted
+    """
+    background = get_mask_background(masks)
+    volumes, masks = flip_3d(volumes, flips), flip_3d(masks, flips)
+
+    for i, axes in enumerate(ROTATION_AXES):
+        volumes = rotate_3d(volumes, plane_angles[:, i], axes)
+        masks = rotate_3d(masks, plane_angles[:, i], axes, nearest=True, fill=background)
+
+    # color distortion (THIS DOESN'T CHANGE IN THE MASK)
+    distorted = distort_color_3d(volumes, delta, contrast_factor)
+    return tf.where(_per_sample(apply_color, 5), distorted, volumes), masks
+
+
+def augment_scan_and_mask_tf(volumes, masks):
+    """
+    Batched version of augment_scan_and_mask, for a tf.data map over batches of segmentation data.
+    Masks are integer label maps or one-hot, voxels rotated in from outside the volume are background in both.
+    """
+    batch_size = tf.shape(volumes)[0]
+    flips = tf.random.uniform([batch_size, 3]) < 0.5
+
+    # make rotation arbitrary instead of multiples of 90deg
+    apply = tf.random.uniform([batch_size]) < 0.5
+    axis_choice = tf.random.uniform([batch_size], 0, 3, dtype=tf.int32)
+    angles = tf.random.uniform([batch_size], 0, 360)
+    plane_angles = tf.where(tf.logical_and(apply[:, tf.newaxis], tf.one_hot(axis_choice, 3) > 0),
+                            angles[:, tf.newaxis], tf.zeros([batch_size, 3]))
+
+    apply_color = tf.random.uniform([batch_size]) < 0.7
+    delta = tf.random.uniform([batch_size], -0.125, 0.125)
+    contrast_factor = tf.random.uniform([batch_size], 0.5, 1.5)
+
+    return transform_scan_and_mask_tf(volumes, masks, flips, plane_angles, apply_color, delta, contrast_factor)
@@ -4,22 +4,24 @@ from math import sqrt
 
 from self_supervised_3d_tasks.preprocessing.utils.crop import crop, crop_patches, crop_patches_3d, crop_3d
 from self_supervised_3d_tasks.preprocessing.utils.pad import pad_to_final_size_2d, pad_to_final_size_3d
+from self_supervised_3d_tasks.preprocessing.utils.parallel import map_batch
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator, sample_rngs
 
 
-def preprocess_image(image, patch_jitter, patches_per_side, crop_size, is_training=True):
+def preprocess_image(image, patch_jitter, patches_per_side, crop_size, is_training=True, rng=None):
     result = []
     w, h, _ = image.shape
 
     if is_training:
-        image = crop(image, is_training, (crop_size, crop_size))
+        image = crop(image, is_training, (crop_size, crop_size), rng)
         image = pad_to_final_size_2d(image, w)
 
-    for patch in crop_patches(image, is_training, patches_per_side, patch_jitter):
+    for patch in crop_patches(image, is_training, patches_per_side, patch_jitter, rng):
         if is_training:
             normal_patch_size = patch.shape[0]
             patch_crop_size = int(normal_patch_size * (11.0 / 12.0))
 
-            patch = crop(patch, is_training, (patch_crop_size, patch_crop_size))
+            patch = crop(patch, is_training, (patch_crop_size, patch_crop_size), rng)
             patch = pad_to_final_size_2d(patch, normal_patch_size)
 
         else:
@@ -30,17 +32,17 @@ def preprocess_image(image, patch_jitter, patches_per_side, crop_size, is_traini
     return np.asarray(result)
 
 
-def preprocess_2d(batch, crop_size, patches_per_side, is_training=True):
+def preprocess_2d(batch, crop_size, patches_per_side, is_training=True, rngs=None):
     _, w, h, _ = batch.shape
     assert w == h, "accepting only squared images"
 
     patch_jitter = int(- w / (patches_per_side + 1))  # overlap half of the patch size
-    return np.array([preprocess_image(image=image, patch_jitter=patch_jitter,
-                                      patches_per_side=patches_per_side, crop_size=crop_size,
-                                      is_training=is_training) for image in batch])
+    return map_batch(lambda image, rng: preprocess_image(image=image, patch_jitter=patch_jitter,
+                                                         patches_per_side=patches_per_side, crop_size=crop_size,
+                                                         is_training=is_training, rng=rng), batch, rngs)
 
 
-def preprocess_grid_2d(image):
+def preprocess_grid_2d(image, rngs=None):
     patches_enc = []
     patches_pred = []
     labels = []
@@ -48,6 +50,7 @@ def preprocess_grid_2d(image):
     shape = image.shape
     patch_size = int(sqrt(shape[1]))
     batch_size = shape[0]
+    rngs = sample_rngs(rngs, batch_size)
 
     def get_patch_at(batch, x, y, mirror=False, predict_zero_instead_mirror=True):
         if batch < 0 or batch >= batch_size:
@@ -132,8 +135,8 @@ def preprocess_grid_2d(image):
             r_col = col_index
 
             while r_batch == batch_index and r_col == col_index:
-                r_batch = np.random.randint(batch_size)
-                r_col = np.random.randint(patch_size)
+                r_batch = int(rngs[batch_index].integers(batch_size))
+                r_col = int(rngs[batch_index].integers(patch_size))
 
             predict_terms = get_following_patches(r_batch, end_patch_index + 2, r_col)
             patches_enc.append(np.stack(terms))
@@ -142,24 +145,24 @@ def preprocess_grid_2d(image):
 
     return [np.stack(patches_enc), np.stack(patches_pred)], np.array(labels)
 
-def preprocess_volume_3d(volume, crop_size, patches_per_side, patch_overlap, is_training=True):
+def preprocess_volume_3d(volume, crop_size, patches_per_side, patch_overlap, is_training=True, rng=None):
     result = []
     w, _, _, _ = volume.shape
 
     if is_training:
-        volume = crop_3d(volume, is_training, (crop_size, crop_size, crop_size))
+        volume = crop_3d(volume, is_training, (crop_size, crop_size, crop_size), rng)
         volume = pad_to_final_size_3d(volume, w)
 
-    for patch in crop_patches_3d(volume, is_training, patches_per_side, -patch_overlap):
+    for patch in crop_patches_3d(volume, is_training, patches_per_side, -patch_overlap, rng):
         if is_training:
             normal_patch_size = patch.shape[0]
             patch_crop_size = int(normal_patch_size * (7.0 / 8.0))
 
-            do_flip = np.random.choice([False, True])
+            do_flip = as_generator(rng).choice([False, True])
             if do_flip:
                 patch = np.flip(patch, 0)
 
-            patch = crop_3d(patch, is_training, (patch_crop_size, patch_crop_size, patch_crop_size))
+            patch = crop_3d(patch, is_training, (patch_crop_size, patch_crop_size, patch_crop_size), rng)
             patch = pad_to_final_size_3d(patch, normal_patch_size)
 
         else:
@@ -170,16 +173,16 @@ def preprocess_volume_3d(volume, crop_size, patches_per_side, patch_overlap, is_
     return np.asarray(result)
 
 
-def preprocess_3d(batch, crop_size, patches_per_side, is_training=True):
+def preprocess_3d(batch, crop_size, patches_per_side, is_training=True, rngs=None):
     _, w, h, d, _ = batch.shape
     assert w == h and h == d, "accepting only cube volumes"
 
     patch_overlap = 0  # dont use overlap here
-    return np.stack([preprocess_volume_3d(volume, crop_size, patches_per_side, patch_overlap, is_training=is_training)
-                     for volume in batch])
+    return map_batch(lambda volume, rng: preprocess_volume_3d(volume, crop_size, patches_per_side, patch_overlap,
+                                                              is_training=is_training, rng=rng), batch, rngs)
 
 
-def preprocess_grid_3d(image, skip_row=False):
+def preprocess_grid_3d(image, skip_row=False, rngs=None):
     patches_enc = []
     patches_pred = []
     labels = []
@@ -187,6 +190,7 @@ def preprocess_grid_3d(image, skip_row=False):
     shape = image.shape
     batch_size = shape[0]
     n_patches_one_dim = int(np.cbrt(shape[1]))
+    rngs = sample_rngs(rngs, batch_size)
 
     def get_patch_at(batch, x, y, z, mirror=False):
         if batch < 0 or batch >= batch_size:
@@ -281,9 +285,9 @@ def preprocess_grid_3d(image, skip_row=False):
                 r_dep = depth_index
 
                 while r_batch == batch_index and r_col == col_index and r_dep == depth_index:
-                    r_batch = np.random.randint(batch_size)
-                    r_col = np.random.randint(n_patches_one_dim)
-                    r_dep = np.random.randint(n_patches_one_dim)
+                    r_batch = int(rngs[batch_index].integers(batch_size))
+                    r_col = int(rngs[batch_index].integers(n_patches_one_dim))
+                    r_dep = int(rngs[batch_index].integers(n_patches_one_dim))
 
                 predict_terms = get_following_patches(r_batch, start_pred_patch_index, r_col, r_dep)
                 patches_enc.append(np.stack(terms))
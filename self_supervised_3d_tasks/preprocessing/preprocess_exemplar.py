@@ -1,26 +1,36 @@
 import functools
-import random
 
 import numpy as np
-import albumentations as ab
 import scipy.ndimage as ndimage
 
 from self_supervised_3d_tasks.preprocessing.utils.crop import crop_3d
 from self_supervised_3d_tasks.preprocessing.utils.pad import pad_to_final_size_3d
+from self_supervised_3d_tasks.preprocessing.utils.parallel import map_batch
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator, sample_rngs
 from self_supervised_3d_tasks.data.preproc_negative_sampling import NegativeSamplingPreprocessing
 
 
-def augment_exemplar_2d(image):
-    return ab.Compose(
-        [
-            ab.RandomRotate90(p=1),
-            ab.VerticalFlip(),
-            ab.HorizontalFlip(),
-            ab.RandomBrightnessContrast(p=1),
-        ]
-    )(image=image)["image"]
+def augment_exemplar_2d(image, rng=None):
+    """
+    The albumentations pipeline RandomRotate90(p=1), VerticalFlip, HorizontalFlip, RandomBrightnessContrast(p=1)
+    with its default limits, drawing from rng instead of the random module.
+    """
+    rng = as_generator(rng)
+
+    image = np.rot90(image, k=int(rng.integers(0, 4)))
+    if rng.random() < 0.5:
+        image = np.flip(image, 0)
+    if rng.random() < 0.5:
+        image = np.flip(image, 1)
+
+    # contrast and brightness by the maximum value of float images, 1.0
+    alpha = 1.0 + rng.uniform(-0.2, 0.2)
+    beta = rng.uniform(-0.2, 0.2)
+    return np.asarray(image, dtype=np.float32) * alpha + beta
+
+def augment_exemplar_3d(image, rng=None):
+    rng = as_generator(rng)
 
-def augment_exemplar_3d(image):
     # prob to apply transforms
     alpha = 0.5
     beta = 0.5
@@ -31,10 +41,10 @@ def augment_exemplar_3d(image):
     def _distort_zoom(scan):
         scan_shape = scan.shape
         factor = 0.2
-        zoom_factors = [np.random.uniform(1 - factor, 1 + factor) for _ in range(scan.ndim - 1)] + [1]
+        zoom_factors = [rng.uniform(1 - factor, 1 + factor) for _ in range(scan.ndim - 1)] + [1]
         scan = ndimage.zoom(scan, zoom_factors, mode="constant")
         scan = pad_to_final_size_3d(scan, scan_shape[0])
-        scan = crop_3d(scan, True, scan_shape)
+        scan = crop_3d(scan, True, scan_shape, rng)
         return scan
 
     def _distort_color(scan):
@@ -45,101 +55,96 @@ def augment_exemplar_3d(image):
         """
         # adjust brightness
         max_delta = 0.125
-        delta = np.random.uniform(-max_delta, max_delta)
+        delta = rng.uniform(-max_delta, max_delta)
         scan += delta
 
         # adjust contrast
         lower = 0.5
         upper = 1.5
-        contrast_factor = np.random.uniform(lower, upper)
+        contrast_factor = rng.uniform(lower, upper)
         scan_mean = np.mean(scan)
         scan = (contrast_factor * (scan - scan_mean)) + scan_mean
         return scan
 
     processed_image = image.copy()
     for i in range(3):
-        if np.random.rand() < 0.5:
+        if rng.random() < 0.5:
             processed_image = np.flip(processed_image, i)
 
     # make rotation arbitrary instead of multiples of 90deg
-    if np.random.rand() < alpha:
-        if np.random.rand() < rotate_only_90:
-            processed_image = np.rot90(processed_image, k=np.random.randint(0, 4), axes=(0, 1))
+    if rng.random() < alpha:
+        if rng.random() < rotate_only_90:
+            processed_image = np.rot90(processed_image, k=int(rng.integers(0, 4)), axes=(0, 1))
         else:
-            processed_image = ndimage.rotate(processed_image, np.random.uniform(0, 360), axes=(0, 1), reshape=False)
+            processed_image = ndimage.rotate(processed_image, rng.uniform(0, 360), axes=(0, 1), reshape=False)
 
-    if np.random.rand() < alpha:
-        if np.random.rand() < rotate_only_90:
-            processed_image = np.rot90(processed_image, k=np.random.randint(0, 4), axes=(1, 2))
+    if rng.random() < alpha:
+        if rng.random() < rotate_only_90:
+            processed_image = np.rot90(processed_image, k=int(rng.integers(0, 4)), axes=(1, 2))
         else:
-            processed_image = ndimage.rotate(processed_image, np.random.uniform(0, 360), axes=(1, 2), reshape=False)
+            processed_image = ndimage.rotate(processed_image, rng.uniform(0, 360), axes=(1, 2), reshape=False)
 
-    if np.random.rand() < alpha:
-        if np.random.rand() < rotate_only_90:
-            processed_image = np.rot90(processed_image, k=np.random.randint(0, 4), axes=(0, 2))
+    if rng.random() < alpha:
+        if rng.random() < rotate_only_90:
+            processed_image = np.rot90(processed_image, k=int(rng.integers(0, 4)), axes=(0, 2))
         else:
-            processed_image = ndimage.rotate(processed_image, np.random.uniform(0, 360), axes=(0, 2), reshape=False)
+            processed_image = ndimage.rotate(processed_image, rng.uniform(0, 360), axes=(0, 2), reshape=False)
 
-    if np.random.rand() < beta:
+    if rng.random() < beta:
         # color distortion
         processed_image = _distort_color(processed_image)
-    if np.random.rand() < gamma:
+    if rng.random() < gamma:
         # zooming
         processed_image = _distort_zoom(processed_image)
 
     return processed_image
 
 
-def make_derangement(indices):
+def make_derangement(indices, rng=None):
     if len(indices) == 1:
         return indices
+    rng = as_generator(rng)
     for i in range(len(indices) - 1, 0, -1):
-        j = random.randrange(i)  # 0 <= j <= i-1
+        j = int(rng.integers(i))  # 0 <= j <= i-1
         indices[j], indices[i] = indices[i], indices[j]
     return indices
 
 
-def preprocessing_exemplar_training_neg_sampling(nsp, ids, x, y, process_3d):
+def augment_batch(x, process_3d, rngs):
+    if process_3d:
+        return map_batch(augment_exemplar_3d, x, rngs)
+
+    return map_batch(augment_exemplar_2d, x, rngs)
+
+
+def preprocessing_exemplar_training_neg_sampling(sampler, ids, x, y, process_3d, rngs=None):
     batch_size = len(y)
     x_processed = np.empty(shape=(batch_size, 3, *x.shape[1:]))
-    triplet = np.empty(shape=(3, *x.shape[1:]))
+    rngs = sample_rngs(rngs, batch_size)
 
-    for i, image in enumerate(x):
-        if process_3d:
-            processed_image = augment_exemplar_3d(image)
-        else:
-            processed_image = augment_exemplar_2d(image)
-        triplet[0] = processed_image  # augmented
-        triplet[1] = image.copy()  # original (pos.)
-        x, _ = nsp.draw_neg_sample([ids[i]])
-        triplet[2] = x  # negative
-        x_processed[i] = triplet.copy()
+    x_processed[:, 0] = augment_batch(x, process_3d, rngs)  # augmented
+    x_processed[:, 1] = x  # original (pos.)
+    for i in range(batch_size):
+        x_processed[i, 2], _ = sampler([ids[i]], rngs[i])  # negative
 
     return x_processed, y
 
 
-def preprocessing_exemplar_training(x, y, process_3d):
+def preprocessing_exemplar_training(x, y, process_3d, rngs=None):
     batch_size = len(y)
     x_processed = np.empty(shape=(batch_size, 3, *x.shape[1:]))
-    triplet = np.empty(shape=(3, *x.shape[1:]))
-    derangement = make_derangement(list(range(len(x))))
-    random_shuffled = x.copy()[derangement]
+    rngs = sample_rngs(rngs, batch_size)
+    derangement = make_derangement(list(range(len(x))), rngs[0])
 
-    for i, image in enumerate(x):
-        if process_3d:
-            processed_image = augment_exemplar_3d(image)
-        else:
-            processed_image = augment_exemplar_2d(image)
-        triplet[0] = processed_image  # augmented
-        triplet[1] = image.copy()  # original (pos.)
-        triplet[2] = random_shuffled[i].copy()  # negative
-        x_processed[i] = triplet.copy()
+    x_processed[:, 0] = augment_batch(x, process_3d, rngs)  # augmented
+    x_processed[:, 1] = x  # original (pos.)
+    x_processed[:, 2] = x[derangement]  # negative
     return x_processed, y
 
-def get_exemplar_training_preprocessing(process_3d=False, sample_neg_examples_from="batch"):
+def get_exemplar_training_preprocessing(process_3d=False, sample_neg_examples_from="batch", negative_pool_size=0):
     if sample_neg_examples_from == "dataset":
         pp_f = functools.partial(preprocessing_exemplar_training_neg_sampling, process_3d=process_3d)
-        nsp = NegativeSamplingPreprocessing(pp_f)
+        nsp = NegativeSamplingPreprocessing(pp_f, negative_pool_size)
         return nsp
     elif sample_neg_examples_from == "batch":
         return functools.partial(preprocessing_exemplar_training, process_3d=process_3d)
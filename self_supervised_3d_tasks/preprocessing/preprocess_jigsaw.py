@@ -1,18 +1,18 @@
-import random
-
 import numpy as np
 
 from self_supervised_3d_tasks.preprocessing.utils.crop import crop_patches, crop_patches_3d
 from self_supervised_3d_tasks.preprocessing.utils.pad import pad_to_final_size_3d, pad_to_final_size_2d
+from self_supervised_3d_tasks.preprocessing.utils.parallel import map_batch
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
 
 
-def preprocess_image(image, is_training, patches_per_side, patch_jitter, permutations, mode3d):
-    label = random.randint(0, len(permutations) - 1)
+def preprocess_image(image, is_training, patches_per_side, patch_jitter, permutations, mode3d, rng=None):
+    label = int(as_generator(rng).integers(0, len(permutations)))
 
     if mode3d:
-        patches = crop_patches_3d(image, is_training, patches_per_side, patch_jitter)
+        patches = crop_patches_3d(image, is_training, patches_per_side, patch_jitter, rng)
     else:
-        patches = crop_patches(image, is_training, patches_per_side, patch_jitter)
+        patches = crop_patches(image, is_training, patches_per_side, patch_jitter, rng)
 
     b = np.zeros((len(permutations),))
     b[label] = 1
@@ -20,19 +20,9 @@ def preprocess_image(image, is_training, patches_per_side, patch_jitter, permuta
     return np.array(patches)[np.array(permutations[label])], np.array(b)
 
 
-def preprocess(batch, patches_per_side, patch_jitter, permutations, is_training=True, mode3d=False):
-    xs = []
-    ys = []
-
-    for image in batch:
-        x, y = preprocess_image(image, is_training, patches_per_side, patch_jitter, permutations, mode3d)
-        xs.append(x)
-        ys.append(y)
-
-    xs = np.stack(xs)
-    ys = np.stack(ys)
-
-    return xs, ys
+def preprocess(batch, patches_per_side, patch_jitter, permutations, is_training=True, mode3d=False, rngs=None):
+    return map_batch(lambda image, rng: preprocess_image(image, is_training, patches_per_side, patch_jitter,
+                                                         permutations, mode3d, rng), batch, rngs)
 
 
 def preprocess_image_crop_only(image, patches_per_side, is_training, mode3d):
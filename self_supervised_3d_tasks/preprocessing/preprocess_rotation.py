@@ -1,12 +1,15 @@
 import numpy as np
 import albumentations as ab
 
+from self_supervised_3d_tasks.preprocessing.utils.rng import sample_rngs
 
-def rotate_batch(x, y=None):
+
+def rotate_batch(x, y=None, rngs=None):
     """
     This function preprocess a batch for relative patch location in a 2 dimensional space.
     :param x: array of images
     :param y: None
+    :param rngs: random generator of every image, None to use the global random state
     :return: x as np.array of images with random rotations, y np.array with one-hot encoded label
     """
     # get batch size
@@ -14,6 +17,7 @@ def rotate_batch(x, y=None):
     # init np array with zeros
     y = np.zeros((batch_size, 4))
     rotated_batch = []
+    rngs = sample_rngs(rngs, batch_size)
     # loop over all images with index and image
     for index, image in enumerate(x):
         # square the image
@@ -21,7 +25,7 @@ def rotate_batch(x, y=None):
             square_size = min(image.shape[0], image.shape[1])
             image = ab.CenterCrop(height=square_size, width=square_size)(image=image)['image']
         # random transformation [0..3]
-        rot = np.random.random_integers(4) - 1
+        rot = int(rngs[index].integers(1, 5)) - 1
         image = np.rot90(image, rot)
         # set image
         rotated_batch.append(image)
@@ -31,12 +35,13 @@ def rotate_batch(x, y=None):
     return np.stack(rotated_batch), y
 
 
-def rotate_batch_3d(x, y=None):
+def rotate_batch_3d(x, y=None, rngs=None):
     batch_size = x.shape[0]
     y = np.zeros((batch_size, 10))
     rotated_batch = []
+    rngs = sample_rngs(rngs, batch_size)
     for index, volume in enumerate(x):
-        rot = np.random.random_integers(10) - 1
+        rot = int(rngs[index].integers(1, 11)) - 1
 
         if rot == 1:
             volume = np.transpose(np.flip(volume, 1), (1, 0, 2, 3))  # 90 deg Z
@@ -1,8 +1,10 @@
 import numpy as np
 import albumentations as ab
 
+from self_supervised_3d_tasks.preprocessing.utils.rng import as_generator
 
-def crop_patches_3d(image, is_training, patches_per_side, patch_jitter=0):
+
+def crop_patches_3d(image, is_training, patches_per_side, patch_jitter=0, rng=None):
     h, w, d, _ = image.shape
 
     patch_overlap = -patch_jitter if patch_jitter < 0 else 0
@@ -19,23 +21,27 @@ def crop_patches_3d(image, is_training, patches_per_side, patch_jitter=0):
         for j in range(patches_per_side):
             for k in range(patches_per_side):
 
-                p = do_crop_3d(image,
-                            i * h_grid,
-                            j * w_grid,
-                            k * d_grid,
-                            h_grid + patch_overlap,
-                            w_grid + patch_overlap,
-                            d_grid + patch_overlap)
+                x = i * h_grid
+                y = j * w_grid
+                z = k * d_grid
+                h_cell = h_grid + patch_overlap
+                w_cell = w_grid + patch_overlap
+                d_cell = d_grid + patch_overlap
 
                 if h_patch < h_grid or w_patch < w_grid or d_patch < d_grid:
-                    p = crop_3d(p, is_training, [h_patch, w_patch, d_patch])
+                    # crop the jittered patch straight from the image, lazy volumes then only read the patch
+                    x_off, y_off, z_off = get_crop_offset_3d((h_cell, w_cell, d_cell), is_training,
+                                                             [h_patch, w_patch, d_patch], rng)
+                    p = do_crop_3d(image, x + x_off, y + y_off, z + z_off, h_patch, w_patch, d_patch)
+                else:
+                    p = do_crop_3d(image, x, y, z, h_cell, w_cell, d_cell)
 
                 patches.append(p)
 
     return patches
 
 
-def crop_patches(image, is_training, patches_per_side, patch_jitter=0):
+def crop_patches(image, is_training, patches_per_side, patch_jitter=0, rng=None):
     h, w, _ = image.shape
 
     patch_overlap = - patch_jitter if patch_jitter < 0 else 0
@@ -56,20 +62,21 @@ def crop_patches(image, is_training, patches_per_side, patch_jitter=0):
                         w_grid + patch_overlap)
 
             if h_patch < h_grid or w_patch < w_grid:
-                p = crop(p, is_training, [h_patch, w_patch])
+                p = crop(p, is_training, [h_patch, w_patch], rng)
 
             patches.append(p)
 
     return patches
 
 
-def crop(image, is_training, crop_size):
+def crop(image, is_training, crop_size, rng=None):
     h, w, = crop_size[0], crop_size[1]
     h_old, w_old = image.shape[0], image.shape[1]
 
     if is_training:
-        x = np.random.randint(0, 1+h_old-h)
-        y = np.random.randint(0, 1+w_old-w)
+        rng = as_generator(rng)
+        x = int(rng.integers(0, 1+h_old-h))
+        y = int(rng.integers(0, 1+w_old-w))
     else:
         x = int((h_old - h) / 2)
         y = int((w_old - w) / 2)
@@ -77,22 +84,30 @@ def crop(image, is_training, crop_size):
     return do_crop(image, x, y, h, w)
 
 
-def crop_3d(image, is_training, crop_size):
+def crop_3d(image, is_training, crop_size, rng=None):
     h, w, d = crop_size[0], crop_size[1], crop_size[2]
-    h_old, w_old, d_old = image.shape[0], image.shape[1], image.shape[2]
+    x, y, z = get_crop_offset_3d(image.shape, is_training, crop_size, rng)
+
+    return do_crop_3d(image, x, y, z, h, w, d)
+
+
+def get_crop_offset_3d(shape, is_training, crop_size, rng=None):
+    h, w, d = crop_size[0], crop_size[1], crop_size[2]
+    h_old, w_old, d_old = shape[0], shape[1], shape[2]
 
     if is_training:
         # crop random
-        x = np.random.randint(0, 1+h_old-h)
-        y = np.random.randint(0, 1+w_old-w)
-        z = np.random.randint(0, 1+d_old-d)
+        rng = as_generator(rng)
+        x = int(rng.integers(0, 1+h_old-h))
+        y = int(rng.integers(0, 1+w_old-w))
+        z = int(rng.integers(0, 1+d_old-d))
     else:
         # crop center
         x = int((h_old - h) / 2)
         y = int((w_old - w) / 2)
         z = int((d_old - d) / 2)
 
-    return do_crop_3d(image, x, y, z, h, w, d)
+    return x, y, z
 
 
 def do_crop(image, x, y, h, w):
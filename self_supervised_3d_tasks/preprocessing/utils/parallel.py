@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from self_supervised_3d_tasks.preprocessing.utils.rng import sample_rngs
+
+_threads = 1
+_executor = None
+_executor_pid = None
+
+
+def set_preprocessing_threads(threads):
+    """
+    Number of threads the samples of a batch are preprocessed in, 1 preprocesses them one after another.
+    Most of the per-sample work is numpy and scipy code that releases the GIL.
+    """
+    global _threads, _executor
+    _threads = max(int(threads), 1)
+    _executor = None
+
+
+def get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        # forked prefetching workers do not inherit the threads
+        _executor = ThreadPoolExecutor(max_workers=_threads)
+        _executor_pid = os.getpid()
+
+    return _executor
+
+
+def map_batch(f, batch, rngs=None):
+    """
+    Apply f(sample, rng) to every sample of a batch and stack the results. Every sample is preprocessed
+    with its own random generator, so the results do not depend on the thread that builds them.
+    :param f: function of one sample and its generator, returning an array or a tuple of arrays
+    :param rngs: random generator of every sample, None to use the global random state
+    :return: array, or tuple of arrays, with the results of every sample along the first axis
+    """
+    rngs = sample_rngs(rngs, len(batch))
+
+    # the first result gives the shapes of the output arrays, the others are written into them directly
+    first = f(batch[0], rngs[0])
+    is_tuple = isinstance(first, tuple)
+    first = first if is_tuple else (first,)
+
+    outputs = []
+    for r in first:
+        r = np.asarray(r)
+        out = np.empty((len(batch),) + r.shape, dtype=r.dtype)
+        out[0] = r
+        outputs.append(out)
+
+    def run(i):
+        result = f(batch[i], rngs[i])
+        for out, r in zip(outputs, result if is_tuple else (result,)):
+            out[i] = r
+
+    if _threads > 1 and len(batch) > 2:
+        # list() waits for every sample and raises the first exception of the threads
+        list(get_executor().map(run, range(1, len(batch))))
+    else:
+        for i in range(1, len(batch)):
+            run(i)
+
+    return tuple(outputs) if is_tuple else outputs[0]
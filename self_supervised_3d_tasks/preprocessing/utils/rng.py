@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class GlobalRandom:
+    """
+    The np.random.Generator methods used by the preprocessing, drawing from the global numpy random state.
+    Preprocessing called without per-sample generators draws the same numbers as before they were introduced.
+    """
+
+    def integers(self, low, high=None, size=None):
+        return np.random.randint(low, high, size)
+
+    def random(self, size=None):
+        return np.random.random_sample(size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return np.random.uniform(low, high, size)
+
+    def choice(self, a, size=None, replace=True, p=None):
+        return np.random.choice(a, size, replace, p)
+
+    def permutation(self, x):
+        return np.random.permutation(x)
+
+
+GLOBAL_RANDOM = GlobalRandom()
+
+
+def as_generator(rng):
+    return GLOBAL_RANDOM if rng is None else rng
+
+
+def sample_rngs(rngs, n):
+    # the generator of every sample in a batch
+    return [GLOBAL_RANDOM] * n if rngs is None else rngs
+
+
+def make_sample_rngs(seed, epoch, file_indices):
+    """
+    One independent stream per file, derived from the seed, the epoch and the position of the file in the epoch.
+    A file gets the same stream no matter which thread or process builds its batch.
+    """
+    return [np.random.default_rng([seed, epoch, int(k)]) for k in file_indices]
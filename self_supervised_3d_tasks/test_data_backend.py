@@ -2,6 +2,9 @@ from self_supervised_3d_tasks.data.kaggle_retina_data import get_kaggle_generato
 from self_supervised_3d_tasks.data.make_data_generator import get_data_generators
 from self_supervised_3d_tasks.data.numpy_2d_loader import Numpy2DLoader
 from self_supervised_3d_tasks.data.segmentation_task_loader import SegmentationGenerator3D
+from self_supervised_3d_tasks.data.tfrecord_loader import TFRecordGenerator
+from self_supervised_3d_tasks.data.tf_data_adapter import make_tf_dataset
+from self_supervised_3d_tasks.preprocessing.augment_3d_tf import augment_scan_and_mask_tf
 import numpy as np
 
 def get_dataset_regular_train(
@@ -14,6 +17,7 @@ def get_dataset_regular_train(
         val_split=0.1,
         train_data_generator_args={},
         val_data_generator_args={},
+        sparse_labels=False,
         **kwargs,
 ):
     train_split = train_split * (1 - val_split)  # normalize train split
@@ -24,11 +28,11 @@ def get_dataset_regular_train(
         train_split=train_split,
         val_split=val_split,  # we are eventually not using the full dataset here
         train_data_generator_args={
-            **{"batch_size": batch_size, "pre_proc_func": f_train},
+            **{"batch_size": batch_size, "pre_proc_func": f_train, "sparse_labels": sparse_labels},
             **train_data_generator_args,
         },
         val_data_generator_args={
-            **{"batch_size": batch_size, "pre_proc_func": f_val},
+            **{"batch_size": batch_size, "pre_proc_func": f_val, "sparse_labels": sparse_labels},
             **val_data_generator_args,
         },
         **kwargs,
@@ -43,6 +47,7 @@ def get_dataset_regular_test(
         data_dir_test,
         train_data_generator_args={},
         test_data_generator_args={},
+        sparse_labels=False,
         **kwargs,
 ):
     if "val_split" in kwargs:
@@ -52,7 +57,7 @@ def get_dataset_regular_test(
         data_generator=data_generator,
         data_path=data_dir_test,
         train_data_generator_args={
-            **{"batch_size": batch_size, "pre_proc_func": f_test},
+            **{"batch_size": batch_size, "pre_proc_func": f_test, "sparse_labels": sparse_labels},
             **test_data_generator_args,
         },
         **kwargs,
@@ -138,7 +143,22 @@ def get_data_from_gen(gen):
     return data, labels
 
 
+def as_tf_data(gen_train, gen_val, tf_data_prefetch=False, tf_data_cache=False, tf_augment=False, **kwargs):
+    if not tf_data_prefetch:
+        return gen_train, gen_val
+
+    # augment the 3D segmentation train batches in the tf.data runtime, also when they are cached
+    map_func = augment_scan_and_mask_tf if tf_augment else None
+
+    return (make_tf_dataset(gen_train, cache=tf_data_cache, map_func=map_func),
+            make_tf_dataset(gen_val, cache=tf_data_cache) if gen_val is not None else None)
+
+
 def get_dataset_train(dataset_name, batch_size, f_train, f_val, train_split, kwargs):
+    return as_tf_data(*get_generators_train(dataset_name, batch_size, f_train, f_val, train_split, kwargs), **kwargs)
+
+
+def get_generators_train(dataset_name, batch_size, f_train, f_val, train_split, kwargs):
     if dataset_name == "kaggle_retina":
         return get_dataset_kaggle_train_original(
             batch_size, f_train, f_val, train_split, **kwargs
@@ -161,6 +181,15 @@ def get_dataset_train(dataset_name, batch_size, f_train, f_val, train_split, kwa
             data_generator=Numpy2DLoader,
             **kwargs,
         )
+    elif dataset_name == "brats_tfrecord" or dataset_name == "ukb_tfrecord":
+        return get_dataset_regular_train(
+            batch_size,
+            f_train,
+            f_val,
+            train_split,
+            data_generator=TFRecordGenerator,
+            **kwargs,
+        )
     else:
         raise ValueError("not implemented")
 
@@ -179,6 +208,10 @@ def get_dataset_test(dataset_name, batch_size, f_test, kwargs):
             data_generator=Numpy2DLoader,
             **kwargs,
         )
+    elif dataset_name == "brats_tfrecord" or dataset_name == "ukb_tfrecord":
+        gen_test = get_dataset_regular_test(
+            batch_size, f_test, data_generator=TFRecordGenerator, **kwargs
+        )
     else:
         raise ValueError("not implemented")
 
@@ -214,6 +247,7 @@ class CvDataKaggle:
         **kwargs):
 
         assert dataset_name == "kaggle_retina", "CV only implemented for kaggle so far"
+        self.kwargs = kwargs
 
         f_train, f_val = algorithm_def.get_finetuning_preprocessing()
         self.cv = get_kaggle_cross_validation(data_path=data_dir, csv_file=csv_file,
@@ -239,4 +273,5 @@ class CvDataKaggle:
                                                                val_split=self.val_split)
 
         x_test, y_test = get_data_from_gen(gen_test)
+        gen_train, gen_val = as_tf_data(gen_train, gen_val, **self.kwargs)
         return gen_train, gen_val, x_test, y_test
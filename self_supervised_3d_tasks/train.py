@@ -2,11 +2,17 @@ from self_supervised_3d_tasks.data.numpy_2d_loader import Numpy2DLoader
 from self_supervised_3d_tasks.utils.model_utils import init, print_flat_summary
 from pathlib import Path
 
+import tensorflow as tf
 import tensorflow.keras as keras
 from self_supervised_3d_tasks.data.numpy_3d_loader import DataGeneratorUnlabeled3D
 
 from self_supervised_3d_tasks.data.make_data_generator import get_data_generators
+from self_supervised_3d_tasks.data.prefetch import BatchPrefetcher
+from self_supervised_3d_tasks.data.shape_buckets import check_bucketed_model, uses_shape_buckets
+from self_supervised_3d_tasks.preprocessing.utils.parallel import set_preprocessing_threads
+from self_supervised_3d_tasks.data.tf_data_adapter import make_tf_dataset
 from self_supervised_3d_tasks.data.image_2d_loader import DataGeneratorUnlabeled2D
+from self_supervised_3d_tasks.data.tfrecord_loader import TFRecordGenerator
 from self_supervised_3d_tasks.algorithms import cpc, jigsaw, relative_patch_location, rotation, exemplar
 from self_supervised_3d_tasks.utils.model_utils import get_writing_path
 
@@ -23,12 +29,15 @@ data_gen_list = {
     "pancreas3d": DataGeneratorUnlabeled3D,
     "pancreas2d": Numpy2DLoader,
     "brats": DataGeneratorUnlabeled3D,
-    "ukb": DataGeneratorUnlabeled3D
+    "ukb": DataGeneratorUnlabeled3D,
+    "brats_tfrecord": TFRecordGenerator,
+    "ukb_tfrecord": TFRecordGenerator
 }
 
 
 def get_dataset(data_dir, batch_size, f_train, f_val, train_val_split, dataset_name,
-                train_data_generator_args={}, val_data_generator_args={}, **kwargs):
+                train_data_generator_args={}, val_data_generator_args={}, tf_data_prefetch=False, tf_data_cache=False,
+                file_shape=None, **kwargs):
     data_gen_type = data_gen_list[dataset_name]
 
     train_data, validation_data = get_data_generators(data_dir, train_split=train_val_split,
@@ -38,14 +47,28 @@ def get_dataset(data_dir, batch_size, f_train, f_val, train_val_split, dataset_n
                                                       val_data_generator_args={**{"batch_size": batch_size,
                                                                                   "pre_proc_func": f_val},
                                                                                **val_data_generator_args},
-                                                      data_generator=data_gen_type)
+                                                      data_generator=data_gen_type, file_shape=file_shape)
+
+    if tf_data_prefetch:
+        train_data = make_tf_dataset(train_data, cache=tf_data_cache)
+        validation_data = make_tf_dataset(validation_data, cache=tf_data_cache)
 
     return train_data, validation_data
 
 
+def get_steps(data):
+    # a tf.data.Dataset is iterated until it is exhausted
+    if isinstance(data, tf.data.Dataset):
+        return None
+
+    return len(data)
+
+
 def train_model(algorithm, data_dir, dataset_name, root_config_file, epochs=250, batch_size=2, train_val_split=0.9,
-                base_workspace="~/workspace/self-supervised-transfer-learning/", save_checkpoint_every_n_epochs=50, **kwargs):
+                base_workspace="~/workspace/self-supervised-transfer-learning/", save_checkpoint_every_n_epochs=50,
+                workers=0, max_queue_size=10, preprocessing_threads=1, **kwargs):
     kwargs["root_config_file"] = root_config_file
+    set_preprocessing_threads(preprocessing_threads)
 
     working_dir = get_writing_path(Path(base_workspace).expanduser() / (algorithm + "_" + dataset_name),
                                    root_config_file)
@@ -53,9 +76,18 @@ def train_model(algorithm, data_dir, dataset_name, root_config_file, epochs=250,
 
     f_train, f_val = algorithm_def.get_training_preprocessing()
     train_data, validation_data = get_dataset(data_dir, batch_size, f_train, f_val, train_val_split, dataset_name, **kwargs)
+
+    if workers > 0 and not isinstance(train_data, tf.data.Dataset):
+        # build batches in worker processes while the model trains
+        train_data = BatchPrefetcher(train_data, workers=workers, max_queue_size=max_queue_size)
+        validation_data = BatchPrefetcher(validation_data, workers=workers, max_queue_size=max_queue_size)
+
     model = algorithm_def.get_training_model()
     print_flat_summary(model)
 
+    if uses_shape_buckets(kwargs):
+        check_bucketed_model(model)
+
     tb_c = keras.callbacks.TensorBoard(log_dir=str(working_dir))
     mc_c = keras.callbacks.ModelCheckpoint(str(working_dir / "weights-improvement-{epoch:03d}.hdf5"), monitor="val_loss",
                                            mode="min", save_best_only=True)  # reduce storage space
@@ -65,11 +97,12 @@ def train_model(algorithm, data_dir, dataset_name, root_config_file, epochs=250,
     # Trains the model
     model.fit_generator(
         generator=train_data,
-        steps_per_epoch=len(train_data),
+        steps_per_epoch=get_steps(train_data),
         validation_data=validation_data,
-        validation_steps=len(validation_data),
+        validation_steps=get_steps(validation_data),
         epochs=epochs,
-        callbacks=callbacks
+        callbacks=callbacks,
+        shuffle=False  # the generators shuffle their files, batches sharing a file stay next to each other
     )
 
 def main():
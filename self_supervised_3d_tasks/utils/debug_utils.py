@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import nibabel as nib
 import numpy as np
 
+from self_supervised_3d_tasks.data.intensity_stats import normalize_volume
 from self_supervised_3d_tasks.data.make_data_generator import get_data_generators
 from self_supervised_3d_tasks.data.numpy_2d_loader import Numpy2DLoader
 from self_supervised_3d_tasks.data.numpy_3d_loader import DataGeneratorUnlabeled3D
@@ -123,11 +124,8 @@ def get_data_npy(path):
     return img
 
 
-def get_data_norm_npy(path):
-    img = np.load(path)
-    img = (img - img.min()) / (img.max() - img.min())
-
-    return img
+def get_data_norm_npy(path, stats=None):
+    return normalize_volume(np.load(path), stats)
 
 def test_exppp():
     path = "/mnt/mpws2019cl1/Task07_Pancreas/images_resized_128_bbox_labeled/train"
@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 import tensorflow as tf
 from sklearn.metrics import cohen_kappa_score, accuracy_score, jaccard_score
@@ -68,6 +70,31 @@ def weighted_dice_coefficient_loss(y_true, y_pred):
     return -weighted_dice_coefficient(y_true, y_pred)
 
 
+def one_hot_labels(y_true, y_pred):
+    # integer label maps (..., 1) from loaders with sparse_labels, the class count is taken from the model output
+    return K.one_hot(K.cast(y_true[..., 0], "int32"), int(y_pred.shape[-1]))
+
+
+def sparse_labels(f):
+    """
+    Wrap a loss or metric for one-hot labels, so it accepts the integer label maps of loaders with sparse_labels.
+    """
+    @functools.wraps(f)
+    def f_sparse(y_true, y_pred):
+        return f(one_hot_labels(y_true, y_pred), y_pred)
+
+    return f_sparse
+
+
+def sparse_weighted_dice_coefficient_loss(y_true, y_pred):
+    return weighted_dice_coefficient_loss(one_hot_labels(y_true, y_pred), y_pred)
+
+
+def sparse_weighted_categorical_crossentropy(weights=(1, 5, 10)):
+    # Note: this is specific for 3 classes
+    return sparse_labels(weighted_categorical_crossentropy(weights))
+
+
 def weighted_sum_loss(alpha=0.5, beta=0.5, weights=(1, 5, 10)):
     # Note: this is specific for 3 classes
 
@@ -118,31 +145,41 @@ def score_cat_acc(y, y_pred):
     return accuracy_score(y, y_pred)
 
 
+def _to_class_indices(y):
+    # ground truth is either one-hot or an integer label map (..., 1)
+    if y.shape[-1] == 1:
+        return np.rint(y[..., 0]).astype(np.int).flatten()
+
+    return np.argmax(y, axis=-1).flatten()
+
+
+def _dice_per_class(y, y_pred):
+    j = jaccard_score(y, y_pred, average=None)
+
+    return np.array([(2 * x) / (1 + x) for x in j])
+
+
 def score_jaccard(y, y_pred):
-    y = np.argmax(y, axis=-1).flatten()
+    y = _to_class_indices(y)
     y_pred = np.argmax(y_pred, axis=-1).flatten()
 
     return jaccard_score(y, y_pred, average="macro")
 
 
 def score_dice(y, y_pred):
-    y = np.argmax(y, axis=-1).flatten()
+    y = _to_class_indices(y)
     y_pred = np.argmax(y_pred, axis=-1).flatten()
 
-    j = jaccard_score(y, y_pred, average=None)
-
-    return np.average(np.array([(2 * x) / (1 + x) for x in j]))
+    return np.average(_dice_per_class(y, y_pred))
 
 def score_dice_class(y, y_pred, class_to_predict):
-    y = np.argmax(y, axis=-1).flatten()
+    y = _to_class_indices(y)
     y_pred = np.argmax(y_pred, axis=-1).flatten()
 
-    j = jaccard_score(y, y_pred, average=None)
-
-    return np.array([(2 * x) / (1 + x) for x in j])[class_to_predict]
+    return _dice_per_class(y, y_pred)[class_to_predict]
 
 def brats_et(y, y_pred):
-    y = np.argmax(y, axis=-1).flatten()
+    y = _to_class_indices(y)
     y_pred = np.argmax(y_pred, axis=-1).flatten()
     gt_et = np.copy(y).astype(np.int)
     gt_et[gt_et == 1] = 0
@@ -152,12 +189,12 @@ def brats_et(y, y_pred):
     pd_et[pd_et == 1] = 0
     pd_et[pd_et == 2] = 0
     pd_et[pd_et == 3] = 1
-    dice_et = score_dice(gt_et, pd_et)
+    dice_et = np.average(_dice_per_class(gt_et, pd_et))
     return dice_et
 
 
 def brats_tc(y, y_pred):
-    y = np.argmax(y, axis=-1).flatten()
+    y = _to_class_indices(y)
     y_pred = np.argmax(y_pred, axis=-1).flatten()
     gt_tc = np.copy(y).astype(np.int)
     gt_tc[gt_tc == 2] = 0
@@ -165,12 +202,12 @@ def brats_tc(y, y_pred):
     pd_tc = np.copy(y_pred).astype(np.int)
     pd_tc[pd_tc == 2] = 0
     pd_tc[pd_tc == 3] = 1
-    dice_tc = score_dice(gt_tc, pd_tc)
+    dice_tc = np.average(_dice_per_class(gt_tc, pd_tc))
     return dice_tc
 
 
 def brats_wt(y, y_pred):
-    y = np.argmax(y, axis=-1).flatten()
+    y = _to_class_indices(y)
     y_pred = np.argmax(y_pred, axis=-1).flatten()
     gt_wt = np.copy(y).astype(np.int)
     gt_wt[gt_wt == 2] = 1
@@ -178,7 +215,7 @@ def brats_wt(y, y_pred):
     pd_wt = np.copy(y_pred).astype(np.int)
     pd_wt[pd_wt == 2] = 1
     pd_wt[pd_wt == 3] = 1
-    dice_wt = score_dice(gt_wt, pd_wt)
+    dice_wt = np.average(_dice_per_class(gt_wt, pd_wt))
     return dice_wt
 
 